@@ -0,0 +1,81 @@
+from __future__ import print_function
+
+import climate
+import numpy as np
+import os
+import shutil
+import tempfile
+import timeit
+
+import ingest
+
+logging = climate.get_logger('bench-csv')
+
+
+def write_trial(path, frames, markers, rng):
+    '''Write a synthetic trial file in the format of Trial.write_records.'''
+    header = ['frame', 'elapsed_time',
+              'target_x', 'target_y', 'target_z',
+              'finger_x', 'finger_y', 'finger_z',
+              'head_x', 'head_y', 'head_z']
+    for m in range(markers):
+        header.extend('{}_{}'.format(m, f) for f in 'xyzc')
+    values = rng.randn(frames, len(header))
+    values[:, 0] = np.arange(frames)
+    values[:, 1] = np.cumsum(rng.uniform(0.01, 0.02, frames))
+    values[:, 14::4] = rng.choice([-1, 1], (frames, markers), p=[0.05, 0.95])
+    with open(path, 'w') as handle:
+        print(','.join(header), file=handle)
+        for row in values:
+            print(','.join(str(f) for f in row.tolist()), file=handle)
+
+
+@climate.annotate(
+    trials=('number of synthetic trial files', 'option', None, int),
+    frames=('number of frames per trial', 'option', None, int),
+    markers=('number of mocap markers per frame', 'option', None, int),
+    repeat=('time each reader this many times', 'option', None, int),
+)
+def main(trials=20, frames=120, markers=50, repeat=3):
+    rng = np.random.RandomState(0)
+    root = tempfile.mkdtemp()
+    try:
+        paths = [os.path.join(root, '{}.csv'.format(i)) for i in range(trials)]
+        for path in paths:
+            write_trial(path, frames, markers, rng)
+        size = sum(os.path.getsize(p) for p in paths)
+        logging.info('wrote %d trials, %.1f MB', trials, size / 1e6)
+
+        def loadtxt():
+            for p in paths:
+                np.loadtxt(p, skiprows=1, delimiter=',', ndmin=2)
+
+        def read_trial(parser):
+            def read():
+                for p in paths:
+                    ingest.read_trial(p, parser)
+            return read
+
+        for p in paths:
+            expected = np.loadtxt(p, skiprows=1, delimiter=',', ndmin=2)
+            for parser in ingest.PARSERS:
+                assert np.allclose(ingest.read_trial(p, parser)[:, 6:], expected)
+
+        readers = [('np.loadtxt', loadtxt)] + [
+            ('read_trial/' + parser, read_trial(parser))
+            for parser in sorted(ingest.PARSERS)]
+        results = {}
+        for name, reader in readers:
+            elapsed = min(timeit.repeat(reader, number=1, repeat=repeat))
+            results[name] = elapsed
+            print('{:<22s} {:8.1f} ms/trial {:8.1f} MB/s {:6.1f}x'.format(
+                name, 1000 * elapsed / trials, size / 1e6 / elapsed,
+                results['np.loadtxt'] / elapsed))
+        print('numpy {} reads trials with the {} parser'.format(
+            np.__version__, ingest.PARSER))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    climate.call(main)
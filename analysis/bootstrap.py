@@ -0,0 +1,163 @@
+'''Bootstrap confidence intervals for the speed-error regressions.
+
+Each regression of log error on tracing speed is refit on thousands of
+resampled datasets. A resample is represented by the number of times each
+trial was drawn, so all the refits of one regression are computed together
+as weighted least squares in closed form:
+
+>>> samples = bootstrap.resample(speed, np.log(error), clusters=subject)
+>>> (slope_lo, slope_hi), (icept_lo, icept_hi) = bootstrap.intervals(samples)
+
+With ``clusters``, whole subjects are resampled instead of trials, which
+keeps the intervals honest when trials of one subject are correlated.
+``run`` resamples every group and pair from ``errors.summarize`` in a pool
+of processes.
+'''
+
+import climate
+import collections
+import multiprocessing
+import numpy as np
+
+import errors
+
+logging = climate.get_logger('bootstrap')
+
+Job = collections.namedtuple('Job', 'key x y clusters samples seed')
+
+
+def fit(x, y, weights=None):
+    '''Fit lines y = a + b x by least squares, for many weightings at once.
+
+    Parameters
+    ----------
+    x, y : ndarray
+        Observations, with shape (n, ).
+    weights : ndarray, optional
+        Weights (for a resample, the number of draws) of the observations,
+        with shape (..., n). Defaults to equal weights.
+
+    Returns
+    -------
+    fits : ndarray
+        The slope b and intercept a of each fit, with shape (..., 2).
+    '''
+    if weights is None:
+        weights = np.ones_like(x)
+    total = weights.sum(axis=-1)
+    mx = (weights * x).sum(axis=-1) / total
+    my = (weights * y).sum(axis=-1) / total
+    dx = x - mx[..., None]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = ((weights * dx * (y - my[..., None])).sum(axis=-1) /
+                 (weights * dx * dx).sum(axis=-1))
+    return np.stack([slope, my - slope * mx], axis=-1)
+
+
+def resample(x, y, clusters=None, samples=1000, seed=None, batch=1000):
+    '''Refit a regression on bootstrap resamples of its observations.
+
+    Parameters
+    ----------
+    x, y : ndarray
+        Observations, with shape (n, ). Pairs with a non-finite value are
+        dropped.
+    clusters : ndarray, optional
+        Cluster (for example, subject) of each observation. If given, whole
+        clusters are resampled instead of single observations.
+    samples : int, optional
+        Number of resamples. Defaults to 1000.
+    seed : int, optional
+        Seed for the random number generator.
+    batch : int, optional
+        Refit at most this many resamples at once, to bound memory use.
+
+    Returns
+    -------
+    fits : ndarray
+        The slope and intercept fit on each resample, with shape
+        (samples, 2).
+    '''
+    x = np.asarray(x, float)
+    y = np.asarray(y, float)
+    ok = np.isfinite(x) & np.isfinite(y)
+    x, y = x[ok], y[ok]
+    if not len(x):
+        return np.full((samples, 2), np.nan)
+    if clusters is None:
+        clusters = np.arange(len(x))
+    labels, members = np.unique(np.asarray(clusters)[ok], return_inverse=True)
+    rng = np.random.RandomState(seed)
+    uniform = np.ones(len(labels)) / len(labels)
+    fits = np.empty((samples, 2))
+    for start in range(0, samples, batch):
+        draws = rng.multinomial(len(labels), uniform,
+                                size=min(batch, samples - start))
+        fits[start:start + len(draws)] = fit(x, y, draws[:, members])
+    return fits
+
+
+def intervals(fits, level=0.95):
+    '''Get percentile confidence intervals for the slope and intercept.
+
+    Returns
+    -------
+    intervals : ndarray
+        The (low, high) interval of the slope and of the intercept, with shape
+        (2, 2). Resamples whose fit is undefined are ignored.
+    '''
+    tail = 50 * (1 - level)
+    return np.nanpercentile(fits, [tail, 100 - tail], axis=0).T
+
+
+def _resample(job):
+    return job.key, resample(job.x, job.y, job.clusters, job.samples, job.seed)
+
+
+def run(tables, samples=1000, workers=1, cluster=True, mean=False, seed=0):
+    '''Bootstrap the speed-error regressions of every group and pair.
+
+    Parameters
+    ----------
+    tables : dict
+        Per-trial error tables for each group, from ``errors.summarize``.
+    samples : int, optional
+        Number of resamples for each regression. Defaults to 1000.
+    workers : int, optional
+        Number of worker processes. Defaults to 1, which runs serially.
+    cluster : bool, optional
+        Resample subjects rather than trials. Defaults to True.
+    mean : bool, optional
+        Regress the log of the mean error of each trial, rather than of its
+        standard deviation.
+    seed : int, optional
+        Base seed for the resamples; each regression gets its own seed derived
+        from it, so results do not depend on the number of workers.
+
+    Returns
+    -------
+    fits : OrderedDict
+        Maps each (group, pair) to an array with the slope and intercept of
+        each resample, with shape (samples, 2).
+    '''
+    field = 'mean' if mean else 'std'
+    jobs = []
+    for group, table in tables.items():
+        for i, pair in enumerate(errors.PAIRS):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                y = np.log(table[field][:, i])
+            jobs.append(Job((group, pair), table['trial-speed'], y,
+                            table['subject'] if cluster else None,
+                            samples, seed + len(jobs)))
+    logging.info('bootstrapping %d regressions with %d resamples each',
+                 len(jobs), samples)
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.map(_resample, jobs)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        results = [_resample(job) for job in jobs]
+    return collections.OrderedDict(results)
@@ -0,0 +1,224 @@
+'''A disk cache for arrays derived from a dataset.
+
+Coordinates computed from the markers of a dataset, like the finger- or
+head-relative positions from ``util``, are slow to compute but do not change
+unless the dataset does. A cache keeps such arrays as .npy files beside the
+dataset (in ``<name>-cache`` for a dataset file, or ``cache`` inside a dataset
+directory) and returns them memory-mapped:
+
+>>> cache = Cache('measurements.npy')
+>>> relative = cache.transformed(data, util.finger_relative)
+
+Each entry is keyed by a fingerprint of the dataset files and by the name and
+parameters of the computation, so entries are recomputed automatically when
+either changes. Entries for older versions of the dataset, and then the least
+recently used entries, are removed to keep the cache within a disk budget.
+'''
+
+import climate
+import hashlib
+import json
+import numpy as np
+import os
+
+import util
+
+logging = climate.get_logger('cache')
+
+# default disk budget for a cache, in bytes.
+BUDGET = 4e9
+
+
+def root_for(dataset):
+    '''Get the name of the cache directory for a dataset.'''
+    if os.path.isdir(dataset):
+        return os.path.join(dataset, 'cache')
+    return '{}-cache'.format(os.path.splitext(dataset)[0])
+
+
+def fingerprint(dataset):
+    '''Compute a fingerprint of the files in a dataset.
+
+    The fingerprint covers the name, size and modification time of each file
+    (not their contents), so it is cheap to compute even for large datasets.
+    '''
+    paths = [dataset]
+    if os.path.isdir(dataset):
+        cache = root_for(dataset)
+        paths = sorted(os.path.join(base, name)
+                       for base, dirs, names in os.walk(dataset)
+                       if not base.startswith(cache)
+                       for name in names)
+    digest = hashlib.sha1()
+    for path in paths:
+        stat = os.stat(path)
+        digest.update('{}:{}:{!r}\n'.format(
+            os.path.relpath(path, dataset), stat.st_size,
+            stat.st_mtime).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+class Cache(object):
+    '''Derived arrays for one dataset, stored as memory-mapped files.
+
+    Parameters
+    ----------
+    dataset : str
+        Name of the dataset file or directory.
+    budget : float, optional
+        Keep the files in the cache within this many bytes. Defaults to
+        ``BUDGET``.
+    root : str, optional
+        Store the cache in this directory. Defaults to ``root_for(dataset)``.
+    '''
+
+    def __init__(self, dataset, budget=BUDGET, root=None):
+        self.dataset = dataset
+        self.budget = budget
+        self.root = root or root_for(dataset)
+        self.fingerprint = fingerprint(dataset)
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+
+    def path(self, name, **params):
+        '''Get the file name of a cache entry.'''
+        key = hashlib.sha1(json.dumps(
+            params, sort_keys=True, default=repr).encode('utf-8'))
+        return os.path.join(self.root, '{}-{}-{}.npy'.format(
+            name, self.fingerprint, key.hexdigest()[:16]))
+
+    def get(self, name, compute, **params):
+        '''Get a cached array, computing and storing it if needed.
+
+        Parameters
+        ----------
+        name : str
+            Name of the derived array.
+        compute : callable
+            Called with ``params`` as keyword arguments to compute the array,
+            when the cache has no entry for them.
+        params : dict
+            Parameters of the computation. They must be serializable as JSON
+            (or have a stable repr), and are part of the cache key.
+
+        Returns
+        -------
+        array : ndarray
+            The array, memory-mapped read-only from the cache.
+        '''
+        path = self.path(name, **params)
+        if not os.path.exists(path):
+            logging.info('computing %s %s', name, params)
+            self._store(path, lambda tmp: np.save(tmp, compute(**params)))
+        return self._open(path)
+
+    def derived(self, data, name, kernel, **params):
+        '''Get an array computed from each subject of a dense dataset.
+
+        Parameters
+        ----------
+        data : ndarray
+            The dense (subject, block, trial, frame, column) dataset.
+        name : str
+            Name of the derived array.
+        kernel : callable
+            Called as ``kernel(frames, **params)`` with the frames of one
+            subject, with shape (block, trial, frame, column). The results for
+            all subjects are stacked.
+
+        Returns
+        -------
+        array : ndarray
+            The derived array, with the type of the dataset, memory-mapped
+            read-only from the cache.
+        '''
+        path = self.path(name, **params)
+        if not os.path.exists(path):
+            logging.info('computing %s %s', name, params)
+            def write(tmp):
+                first = kernel(np.asarray(data[0]), **params)
+                out = np.lib.format.open_memmap(
+                    tmp, mode='w+', dtype=data.dtype,
+                    shape=(len(data), ) + first.shape)
+                out[0] = first
+                for s in range(1, len(data)):
+                    out[s] = kernel(np.asarray(data[s]), **params)
+                out.flush()
+                del out
+            self._store(path, write)
+        return self._open(path)
+
+    def transformed(self, data, transform, **params):
+        '''Get the marker positions of a dense dataset in another frame.
+
+        Parameters
+        ----------
+        data : ndarray
+            The dense (subject, block, trial, frame, column) dataset.
+        transform : callable
+            A transform like ``util.finger_relative``, called as
+            ``transform(frames, positions, **params)``.
+
+        Returns
+        -------
+        positions : ndarray
+            The transformed positions, with shape (subject, block, trial,
+            frame, 50, 3) and the type of the dataset, memory-mapped
+            read-only from the cache.
+        '''
+        def kernel(frames, **params):
+            return transform(frames, util.markers(frames)[..., :3], **params)
+        return self.derived(data, getattr(transform, '__name__', 'transformed'),
+                            kernel, **params)
+
+    def entries(self):
+        '''List the files in the cache, from least to most recently used.'''
+        paths = [os.path.join(self.root, name) for name in os.listdir(self.root)
+                 if name.endswith('.npy')]
+        return sorted(paths, key=os.path.getmtime)
+
+    def clear(self):
+        '''Remove every file in the cache.'''
+        for path in self.entries():
+            os.remove(path)
+
+    def evict(self, keep=()):
+        '''Remove stale and least recently used entries to fit the budget.
+
+        Entries computed from other versions of the dataset are always
+        removed. Files named in ``keep`` are never removed.
+        '''
+        current = '-{}-'.format(self.fingerprint)
+        entries = []
+        for path in self.entries():
+            if current not in os.path.basename(path):
+                logging.info('removing stale %s', path)
+                os.remove(path)
+            else:
+                entries.append(path)
+        total = sum(os.path.getsize(path) for path in entries)
+        for path in entries:
+            if total <= self.budget:
+                break
+            if path in keep:
+                continue
+            logging.info('removing %s to fit in %.1f GB',
+                         path, self.budget / 1e9)
+            total -= os.path.getsize(path)
+            os.remove(path)
+
+    def _store(self, path, write):
+        # write to a temporary file first, so an interrupted computation does
+        # not leave a partial entry behind.
+        tmp = path[:-4] + '.tmp.npy'
+        try:
+            write(tmp)
+            os.rename(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self.evict(keep=(path, ))
+
+    def _open(self, path):
+        os.utime(path, None)
+        return np.load(path, mmap_mode='r')
@@ -0,0 +1,164 @@
+'''Columnar dataset storage: one memmapped array per group of columns.
+
+A columnar dataset is a directory holding one .npy file for each group in
+``constants.COLUMN_GROUPS`` (config, timing, target, finger, head and
+markers). Each file has shape (subject, block, trial, frame, width), so an
+analysis that only needs the target, finger and head positions reads 9 of
+the 217 columns from disk instead of pulling in every marker with each page.
+
+A dataset opened with only some groups can stand in for the dense dataset in
+the chunked reductions of the reduce module; the other columns are NaN:
+
+>>> data = Dataset('measurements', groups=('target', 'finger', 'head'))
+>>> tables = errors.summarize(data, metadata.for_dataset('measurements'))
+'''
+
+import climate
+import collections
+import numpy as np
+import os
+
+import constants as C
+import ingest
+
+logging = climate.get_logger('columnar')
+
+
+def save(jobs, output, workers=1, dtype='f', report=None):
+    '''Import trials into a columnar dataset directory.
+
+    Parameters
+    ----------
+    jobs : list of ingest.Job
+        Trials to import, in subject/block/trial order.
+    output : str
+        Directory to write. It is created if needed.
+    workers : int, optional
+        Number of worker processes used to parse trial files.
+    dtype : str, optional
+        Data type of the stored arrays. Defaults to float32.
+    report : quality.Report, optional
+        Add the quality metrics of each trial to this report.
+
+    Returns
+    -------
+    dataset : Dataset
+        The saved dataset, opened read-only.
+    '''
+    if not os.path.isdir(output):
+        os.makedirs(output)
+    shape = ingest.dataset_shape(jobs)
+    logging.info('writing %s to %s', shape, output)
+    groups = [(np.lib.format.open_memmap(
+        os.path.join(output, name + '.npy'), mode='w+', dtype=dtype,
+        shape=shape[:4] + (columns.stop - columns.start, )), columns)
+              for name, columns in C.COLUMN_GROUPS.items()]
+    filled = set()
+    for job, frames in ingest.load_trials(jobs, workers, report):
+        index = job.subject, job.block, job.trial
+        for data, columns in groups:
+            data[index][:len(frames)] = frames[:, columns]
+            data[index][len(frames):] = np.nan
+        filled.add(index)
+    for index in np.ndindex(*shape[:3]):
+        if index not in filled:
+            for data, _ in groups:
+                data[index] = np.nan
+    for data, _ in groups:
+        data.flush()
+    del groups
+    return Dataset(output)
+
+
+class Dataset(object):
+    '''A columnar dataset, addressed by the names in ``constants.COLUMNS``.
+
+    Columns are returned as memmapped views with shape (subject, block,
+    trial, frame), so only the files holding the requested columns are read.
+
+    >>> data = Dataset('measurements')
+    >>> data.col('trial-speed')[..., 0]       # speed of each trial
+    >>> data.cols('target-x', 'target-y', 'target-z')
+    >>> data['markers']                       # a whole column group
+
+    Parameters
+    ----------
+    root : str
+        Directory holding the dataset arrays.
+    mmap_mode : str, optional
+        Memory-map mode for the arrays. Defaults to 'r'.
+    groups : sequence of str, optional
+        Open only these column groups. Defaults to all groups.
+    '''
+
+    def __init__(self, root, mmap_mode='r', groups=None):
+        self.root = root
+        self.groups = collections.OrderedDict(
+            (name, np.load(os.path.join(root, name + '.npy'), mmap_mode=mmap_mode))
+            for name in C.COLUMN_GROUPS if groups is None or name in groups)
+
+    @property
+    def shape(self):
+        '''Shape of the equivalent dense dataset.'''
+        first = next(iter(self.groups.values()))
+        return first.shape[:-1] + (len(C.COLUMNS), )
+
+    @property
+    def dtype(self):
+        '''Data type of the stored arrays.'''
+        return next(iter(self.groups.values())).dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, name):
+        if name in self.groups:
+            return self.groups[name]
+        return self.col(name)
+
+    def read_trials(self, start, stop):
+        '''Read a range of trials as dense frames.
+
+        Trials are numbered in (subject, block, trial) order, as in
+        ``reduce.chunks``. Only the open groups are read; the columns of other
+        groups are NaN.
+
+        Returns
+        -------
+        frames : ndarray
+            An array with shape (stop - start, frame, 217).
+        '''
+        shape = self.shape
+        frames = np.empty((stop - start, ) + shape[3:], self.dtype)
+        frames.fill(np.nan)
+        for name, data in self.groups.items():
+            trials = data.reshape((-1, ) + data.shape[3:])
+            frames[..., C.COLUMN_GROUPS[name]] = trials[start:stop]
+        return frames
+
+    def _locate(self, name):
+        '''Find the group holding a column, and its offset in that group.'''
+        index = C.col(name)
+        for group, columns in C.COLUMN_GROUPS.items():
+            if columns.start <= index < columns.stop:
+                return group, index - columns.start
+
+    def col(self, name):
+        '''Get a view of one column, with shape (subject, block, trial, frame).'''
+        group, offset = self._locate(name)
+        return self.groups[group][..., offset]
+
+    def cols(self, *names):
+        '''Get several columns, stacked along a new last axis.
+
+        If the columns are adjacent and in the same group (like the x, y and
+        z columns of the target), the result is a view of the stored array.
+        Otherwise the columns are copied into a new array.
+        '''
+        if len(names) == 1:
+            names = names[0] # assume we got a generator arg
+        located = [self._locate(n) for n in names]
+        group, first = located[0]
+        if all(g == group and o == first + i for i, (g, o) in enumerate(located)):
+            return self.groups[group][..., first:first + len(located)]
+        return np.stack([self.groups[g][..., o] for g, o in located], axis=-1)
@@ -0,0 +1,261 @@
+'''Compressed dataset container with random access to individual trials.
+
+A container is a single file holding each trial as a separately compressed
+chunk, followed by an index of chunk offsets and a small JSON header:
+
+    chunk 0 | chunk 1 | ... | header | index | footer
+
+The 16-byte footer holds a magic string and the file offset of the header,
+so the index can be loaded without reading any trial data. Before
+compression, each trial is stored column by column with the bytes of its
+values shuffled by significance, which lets zlib exploit the constant config
+columns and the slowly changing high-order bytes of the positions.
+
+Trials are decompressed on demand and kept in a small LRU cache, so loops
+that visit the same trials repeatedly stay fast.
+'''
+
+from __future__ import division
+
+import bz2
+import climate
+import collections
+import json
+import numpy as np
+import struct
+import zlib
+
+import constants as C
+import ingest
+
+logging = climate.get_logger('compressed')
+
+MAGIC = b'TRACEZ01'
+
+# compress(data, level) and decompress(data) functions for each codec.
+CODECS = {
+    'zlib': (zlib.compress, zlib.decompress),
+    'bz2': (bz2.compress, bz2.decompress),
+}
+try:
+    import lzma
+    CODECS['lzma'] = (lambda data, level: lzma.compress(data, preset=level),
+                      lzma.decompress)
+except ImportError:
+    pass
+
+
+def _encode(frames, dtype):
+    values = np.ascontiguousarray(np.asarray(frames, dtype).T)
+    return values.view(np.uint8).reshape((-1, values.itemsize)).T.tobytes()
+
+
+def _decode(chunk, dtype, frames, columns):
+    dtype = np.dtype(dtype)
+    raw = np.frombuffer(chunk, np.uint8).reshape((dtype.itemsize, -1)).T
+    return np.ascontiguousarray(raw).view(dtype).reshape((columns, frames)).T
+
+
+def write(trials, shape, output, dtype='f', codec='zlib', level=6):
+    '''Write trials to a compressed container.
+
+    Parameters
+    ----------
+    trials : iterable of ((int, int, int), ndarray)
+        Each (subject, block, trial) index paired with its frame array.
+    shape : tuple of int
+        Number of subjects, blocks and trials in the container. Slots with no
+        trial are stored as empty.
+    output : str
+        Name of the container file to write.
+    dtype : str, optional
+        Data type of the stored values. Defaults to float32.
+    codec : str, optional
+        Compression module to use: 'zlib' (the default), 'bz2' or 'lzma'.
+    level : int, optional
+        Compression level. Defaults to 6.
+    '''
+    shape = tuple(int(n) for n in shape[:3])
+    compress = CODECS[codec][0]
+    index = np.zeros(shape + (3, ), np.int64)
+    raw = packed = 0
+    with open(output, 'wb') as handle:
+        for key, frames in trials:
+            chunk = compress(_encode(frames, dtype), level)
+            index[key] = handle.tell(), len(chunk), len(frames)
+            handle.write(chunk)
+            raw += frames.size * np.dtype(dtype).itemsize
+            packed += len(chunk)
+        offset = handle.tell()
+        header = json.dumps(dict(
+            shape=shape, columns=len(C.COLUMNS), dtype=np.dtype(dtype).str,
+            codec=codec)).encode('ascii')
+        handle.write(struct.pack('<Q', len(header)))
+        handle.write(header)
+        handle.write(index.tobytes())
+        handle.write(MAGIC + struct.pack('<Q', offset))
+    logging.info('wrote %d trials to %s: %.1f MB -> %.1f MB (%.1fx)',
+                 (index[..., 2] > 0).sum(), output, raw / 1e6, packed / 1e6,
+                 raw / max(1, packed))
+
+
+def save(jobs, output, workers=1, dtype='f', codec='zlib', level=6,
+         report=None):
+    '''Import trials into a compressed container.
+
+    Parameters
+    ----------
+    jobs : list of ingest.Job
+        Trials to import.
+    output : str
+        Name of the container file to write.
+    workers : int, optional
+        Number of worker processes used to parse trial files.
+    dtype : str, optional
+        Data type of the stored values. Defaults to float32.
+    codec : str, optional
+        Compression module to use. Defaults to 'zlib'.
+    level : int, optional
+        Compression level. Defaults to 6.
+    report : quality.Report, optional
+        Add the quality metrics of each trial to this report.
+
+    Returns
+    -------
+    container : Container
+        The saved container.
+    '''
+    shape = (1 + max(j.subject for j in jobs),
+             1 + max(j.block for j in jobs),
+             1 + max(j.trial for j in jobs))
+    trials = (((job.subject, job.block, job.trial), frames)
+              for job, frames in ingest.load_trials(jobs, workers, report))
+    write(trials, shape, output, dtype, codec, level)
+    return Container(output)
+
+
+def pack(data, output, codec='zlib', level=6):
+    '''Compress a dense (subject, block, trial, frame, column) dataset.'''
+    trials = ((key, data[key]) for key in np.ndindex(*data.shape[:3]))
+    write(trials, data.shape, output, data.dtype, codec, level)
+
+
+class Container(object):
+    '''Random access to the trials in a compressed container.
+
+    Trials are indexed like the dense dataset, either all at once or one axis
+    at a time:
+
+    >>> data = Container('measurements.trz')
+    >>> data[15, 1, 5]
+    >>> for subject in data:
+    ...     for block in subject[1:]:
+    ...         for trial in block:
+    ...             pass
+
+    Each trial is decompressed when first accessed, and returned as a
+    read-only (frame, column) array.
+
+    Parameters
+    ----------
+    path : str
+        Name of the container file.
+    cache_size : int, optional
+        Keep up to this many decompressed trials in memory, evicting the least
+        recently used trial first. Defaults to 64.
+    '''
+
+    def __init__(self, path, cache_size=64):
+        self.path = path
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self._handle = open(path, 'rb')
+        self._handle.seek(-16, 2)
+        footer = self._handle.read(16)
+        if footer[:8] != MAGIC:
+            raise ValueError('{} is not a trial container'.format(path))
+        self._handle.seek(struct.unpack('<Q', footer[8:])[0])
+        size, = struct.unpack('<Q', self._handle.read(8))
+        header = json.loads(self._handle.read(size).decode('ascii'))
+        self.shape = tuple(header['shape'])
+        self.columns = header['columns']
+        self.dtype = np.dtype(str(header['dtype']))
+        self._decompress = CODECS[header['codec']][1]
+        count = int(np.prod(self.shape)) * 3
+        self.index = np.frombuffer(
+            self._handle.read(8 * count), np.int64).reshape(self.shape + (3, ))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __iter__(self):
+        for s in range(self.shape[0]):
+            yield _Axis(self, (s, ))
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key, )
+        if len(key) == 3 and all(isinstance(k, (int, np.integer)) for k in key):
+            return self.trial(*key)
+        return _Axis(self, ())[key]
+
+    def close(self):
+        self._handle.close()
+
+    def trial(self, subject, block, trial):
+        '''Get the frames of one trial, decompressing it if needed.'''
+        key = []
+        for k, n in zip((subject, block, trial), self.shape):
+            if not -n <= k < n:
+                raise IndexError('index {} out of range for {}'.format(
+                    (subject, block, trial), self.shape))
+            key.append(int(k) % n)
+        key = tuple(key)
+        frames = self._cache.pop(key, None)
+        if frames is None:
+            offset, size, count = self.index[key]
+            frames = np.zeros((0, self.columns), self.dtype)
+            if size > 0:
+                self._handle.seek(offset)
+                frames = _decode(self._decompress(self._handle.read(size)),
+                                 self.dtype, count, self.columns)
+            frames.flags.writeable = False
+            while len(self._cache) >= self.cache_size > 0:
+                self._cache.popitem(last=False)
+        if self.cache_size > 0:
+            self._cache[key] = frames
+        return frames
+
+
+class _Axis(object):
+    '''A lazy view of the subjects, blocks or trials of a container.'''
+
+    def __init__(self, container, prefix, items=None):
+        self.container = container
+        self.prefix = prefix
+        self.items = items
+        if items is None:
+            self.items = range(container.shape[len(prefix)])
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key, )
+        first, rest = key[0], key[1:]
+        if isinstance(first, slice):
+            if rest:
+                raise IndexError('only the last index may be a slice')
+            return _Axis(self.container, self.prefix, self.items[first])
+        index = self.prefix + (self.items[first], )
+        if len(index) == 3:
+            if rest:
+                return self.container.trial(*index)[rest]
+            return self.container.trial(*index)
+        axis = _Axis(self.container, index)
+        return axis[rest] if rest else axis
@@ -1,59 +1,65 @@
 import climate
-import collections
 import lmj.plot
 import numpy as np
 
 from sklearn.linear_model import LinearRegression
 
+import bootstrap
+import cache
+import columnar
 import constants as C
-
-GROUPS = (
-    (C.WEIGHTED, C.DOMINANT),
-    (C.UNWEIGHTED, C.DOMINANT),
-    (C.WEIGHTED, C.NONDOMINANT),
-    (C.UNWEIGHTED, C.NONDOMINANT),
-)
-
-PAIRS = (
-    ('target', 'finger'),
-    ('target', 'head'),
-    ('finger', 'head'),
-)
-
-def distances(trial, src='target', tgt='finger'):
-    src = trial[:, C.cols('{}-{}'.format(src, x) for x in 'xyz')]
-    tgt = trial[:, C.cols('{}-{}'.format(tgt, x) for x in 'xyz')]
-    return 1000 * np.sqrt(((src - tgt) ** 2).sum(axis=1))
-
+import errors
+import filters
+import metadata
 
 @climate.annotate(
     dataset='dataset to plot',
     plot_mean=('if 1, plot means, else stdevs', 'option', None, int),
+    budget=('read at most this many MB of frames at once', 'option', None, int),
+    samples=('bootstrap this many resamples per regression', 'option', None, int),
+    workers=('bootstrap using this many processes', 'option', None, int),
+    cutoff=('low-pass filter positions at this many Hz first', 'option', None, float),
+    layout=('dataset layout: dense, or columnar to read only the columns used',
+            'option', None, str),
 )
-def main(dataset='measurements.npy', plot_mean=0):
+def main(dataset='measurements.npy', plot_mean=0, budget=256, samples=0,
+         workers=1, cutoff=0, layout='dense'):
     plot_mean = plot_mean > 0
 
-    X = np.load(dataset, mmap_mode='r')
+    if layout == 'columnar':
+        if cutoff > 0:
+            raise ValueError('--cutoff needs the dense layout')
+        X = columnar.Dataset(
+            dataset, groups=set(name for pair in errors.PAIRS for name in pair))
+    elif layout == 'dense':
+        X = np.load(dataset, mmap_mode='r')
+    else:
+        raise ValueError('unknown layout "{}"'.format(layout))
     print 'loaded', dataset, X.shape
 
-    series = collections.defaultdict(list)
-
-    for subject in X:
-        for block in subject:
-            for trial in block:
-                weight = trial[0, C.col('block-weight')]
-                if weight != C.UNWEIGHTED:
-                    continue
-                hand = trial[0, C.col('block-hand')]
-                if hand != C.DOMINANT:
-                    continue
-                speed = trial[0, C.col('trial-speed')]
-                for src, tgt in PAIRS:
-                    d = distances(trial, src, tgt)
-                    series[src, tgt].append((speed, d.mean(), d.std()))
-
-    for i, (src, tgt) in enumerate(PAIRS):
-        speed, mean, std = np.array(series[(src, tgt)]).T
+    index = metadata.for_dataset(dataset, X)
+    if cutoff > 0:
+        X = filters.cached(cache.Cache(dataset), X, cutoff=cutoff)
+    tables = errors.summarize(X, index, budget=budget * 2 ** 20)
+    for (weight, hand), table in tables.items():
+        print 'weight', weight, 'hand', hand, len(table), 'trials, mean errors',
+        print np.nanmean(table['mean'], axis=0)
+
+    fits = {}
+    if samples > 0:
+        fits = bootstrap.run(tables, samples, workers, mean=plot_mean)
+        for ((weight, hand), (src, tgt)), resamples in fits.items():
+            (slo, shi), (ilo, ihi) = bootstrap.intervals(resamples)
+            print 'weight', weight, 'hand', hand, src, tgt,
+            print 'slope [%.3f, %.3f] intercept [%.3f, %.3f]' % (slo, shi, ilo, ihi)
+
+    group = C.UNWEIGHTED, C.DOMINANT
+    table = tables[group]
+
+    for i, (src, tgt) in enumerate(errors.PAIRS):
+        speed = table['trial-speed']
+        mean = table['mean'][:, i]
+        std = table['std'][:, i]
         dependent = [std, mean][plot_mean]
         model = LinearRegression()
         model.fit(speed[:, None], np.log(dependent))
@@ -65,13 +71,20 @@ def main(dataset='measurements.npy', plot_mean=0):
             spines.append('left')
         if not plot_mean:
             spines.append('bottom')
-        ax = lmj.plot.axes((1, len(series), i + 1), spines=spines)
+        ax = lmj.plot.axes((1, len(errors.PAIRS), i + 1), spines=spines)
 
         #ax.errorbar(speed, mean, yerr=std, fmt='o', alpha=0.9)
         ax.plot(speed[idx[:100]], dependent[idx[:100]], 'o', color='#111111', alpha=0.7)
         ax.plot([speed.min(), speed.max()],
                 np.exp(model.predict([[speed.min()], [speed.max()]])),
                 '-', color='#cc3333', lw=3)
+        if (group, (src, tgt)) in fits:
+            # 95% band of the bootstrapped regression lines.
+            xs = np.linspace(speed.min(), speed.max(), 50)
+            slope, intercept = fits[group, (src, tgt)].T
+            ys = np.exp(intercept[:, None] + slope[:, None] * xs)
+            lo, hi = np.nanpercentile(ys, [2.5, 97.5], axis=0)
+            ax.fill_between(xs, lo, hi, color='#cc3333', alpha=0.3, lw=0)
 
         ax.set_ylim((10, 1000))
         ax.set_yscale('log')
@@ -0,0 +1,40 @@
+import climate
+import numpy as np
+
+import errors
+import lags
+import metadata
+import reduce
+
+
+@climate.annotate(
+    dataset='dataset to analyze',
+    max_lag=('consider lags up to this many frames', 'option', None, int),
+    budget=('read at most this many MB of frames at once', 'option', None, int),
+)
+def main(dataset='measurements.npy', max_lag=60, budget=256):
+    X = np.load(dataset, mmap_mode='r')
+    print 'loaded', dataset, X.shape
+
+    index = metadata.for_dataset(dataset, X)
+    table = reduce.map_trials(
+        X, lambda frames: lags.trial_lags(frames, max_lag=max_lag),
+        budget * 2 ** 20)
+
+    for weight, hand in errors.GROUPS:
+        rows = index.rows(block_weight=weight, block_hand=hand)
+        if not len(rows):
+            continue
+        group = table[rows['subject'], rows['block'], rows['trial']]
+        print 'weight', weight, 'hand', hand, len(rows), 'trials'
+        for i, (src, tgt) in enumerate(errors.PAIRS):
+            print '  %s -> %s: median lag %.3fs, correlation %.3f, ' \
+                'lag-corrected error %.1fmm' % (
+                    src, tgt,
+                    np.nanmedian(group['delay'][:, i]),
+                    np.nanmedian(group['correlation'][:, i]),
+                    np.nanmedian(group['error'][:, i]))
+
+
+if __name__ == '__main__':
+    climate.call(main)
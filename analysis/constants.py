@@ -1,5 +1,6 @@
 '''Constants for tracing experiments.'''
 
+import collections
 import matplotlib
 import numpy as np
 
@@ -95,13 +96,75 @@ COLUMNS = (
     'm049-x', 'm049-y', 'm049-z', 'm049-c',
 )
 
+# contiguous ranges of related columns, used to store the dataset by column.
+COLUMN_GROUPS = collections.OrderedDict([
+    ('config', slice(0, 6)),
+    ('timing', slice(6, 8)),
+    ('target', slice(8, 11)),
+    ('finger', slice(11, 14)),
+    ('head', slice(14, 17)),
+    ('markers', slice(17, len(COLUMNS))),
+])
+
+# index of each column name, so lookups do not scan COLUMNS.
+COLUMN_INDEX = dict((name, i) for i, name in enumerate(COLUMNS))
+
 def col(name):
-    return COLUMNS.index(name)
+    return COLUMN_INDEX[name]
 
 def cols(*names):
     if len(names) == 1:
         names = names[0] # assume we got a generator arg
-    return [col(n) for n in names]
+    return [COLUMN_INDEX[n] for n in names]
+
+
+# fields of a frame viewed as a record, as (name, first column, shape). fields
+# may overlap, so "timing" covers both "frame" and "elapsed".
+FIELDS = (
+    ('config', 0, (6, )),
+    ('timing', 6, (2, )),
+    ('frame', 6, ()),
+    ('elapsed', 7, ()),
+    ('target', 8, (3, )),
+    ('finger', 11, (3, )),
+    ('head', 14, (3, )),
+    ('markers', 17, (50, 4)),
+)
+
+_FRAME_DTYPES = {}
+
+def frame_dtype(dtype='f'):
+    '''Get a structured dtype covering one frame of values of the given type.
+
+    Each record spans all the columns of ``COLUMNS``, with the fields listed
+    in ``FIELDS`` placed over the matching columns.
+    '''
+    dtype = np.dtype(dtype)
+    if dtype not in _FRAME_DTYPES:
+        names, formats, offsets = zip(*(
+            (name, (dtype, shape), start * dtype.itemsize)
+            for name, start, shape in FIELDS))
+        _FRAME_DTYPES[dtype] = np.dtype(dict(
+            names=names, formats=formats, offsets=offsets,
+            itemsize=len(COLUMNS) * dtype.itemsize))
+    return _FRAME_DTYPES[dtype]
+
+def view(frames):
+    '''View an array of frames as records with the fields in ``FIELDS``.
+
+    The result has the shape of ``frames`` without its last (column) axis, and
+    shares its memory, so ``view(trial)['target']`` is a (frame, 3) view of
+    the target columns and ``view(trial)['markers']`` a (frame, 50, 4) view
+    of the markers. Arrays that are not C-contiguous, like ``trial[::300]``,
+    are copied first.
+    '''
+    frames = np.asarray(frames)
+    if frames.shape[-1] != len(COLUMNS):
+        raise ValueError('expected {} columns, got {}'.format(
+            len(COLUMNS), frames.shape[-1]))
+    if not frames.flags.c_contiguous:
+        frames = np.ascontiguousarray(frames)
+    return frames.view(frame_dtype(frames.dtype))[..., 0]
 
 
 SKELETON = (
@@ -0,0 +1,117 @@
+'''Tracing errors: distances between the target, finger and head.
+
+The distance series of every trial are computed in a few array operations
+over chunks of the dense dataset (see the reduce module), and reduced to a
+mean and standard deviation per trial. The results are then split by condition
+using the metadata table:
+
+>>> tables = errors.summarize(data, metadata.for_dataset('measurements.npy'))
+>>> table = tables[C.UNWEIGHTED, C.DOMINANT]
+>>> table['mean'][:, errors.PAIRS.index(('target', 'finger'))]
+'''
+
+import collections
+import numpy as np
+
+import constants as C
+import reduce
+
+# (block weight, block hand) conditions to compare.
+GROUPS = (
+    (C.WEIGHTED, C.DOMINANT),
+    (C.UNWEIGHTED, C.DOMINANT),
+    (C.WEIGHTED, C.NONDOMINANT),
+    (C.UNWEIGHTED, C.NONDOMINANT),
+)
+
+PAIRS = (
+    ('target', 'finger'),
+    ('target', 'head'),
+    ('finger', 'head'),
+)
+
+DTYPE = np.dtype([
+    ('subject', 'i4'), ('block', 'i4'), ('trial', 'i4'),
+    ('trial-speed', 'f4'),
+    ('mean', 'f4', (len(PAIRS), )),
+    ('std', 'f4', (len(PAIRS), )),
+])
+
+
+def pairwise(frames, pairs=PAIRS):
+    '''Get the distances in mm between several pairs of tracked points.
+
+    Parameters
+    ----------
+    frames : ndarray
+        Frames of data with shape (..., 217), like a trial or the whole dense
+        dataset.
+    pairs : sequence of (str, str), optional
+        Pairs of column groups to measure. Defaults to ``PAIRS``.
+
+    Returns
+    -------
+    distances : ndarray
+        An array with shape (..., len(pairs)). Padding frames give NaN.
+    '''
+    view = C.view(frames)
+    names = sorted(set(name for pair in pairs for name in pair))
+    points = np.stack([view[name] for name in names], axis=-2)
+    src = points[..., [names.index(s) for s, _ in pairs], :]
+    tgt = points[..., [names.index(t) for _, t in pairs], :]
+    return 1000 * np.sqrt(((src - tgt) ** 2).sum(axis=-1))
+
+
+def trial_stats(frames, pairs=PAIRS):
+    '''Get the mean and standard deviation of each distance in each trial.
+
+    Parameters
+    ----------
+    frames : ndarray
+        Frames of data with shape (..., frame, 217). NaN padding frames at the
+        end of each trial are ignored.
+    pairs : sequence of (str, str), optional
+        Pairs of column groups to measure. Defaults to ``PAIRS``.
+
+    Returns
+    -------
+    mean, std : ndarray
+        Arrays with shape (..., len(pairs)). Trials with no frames give NaN.
+    '''
+    moments = reduce.Moments.of(pairwise(frames, pairs), axis=-2)
+    return moments.mean, moments.std
+
+
+def summarize(data, index, groups=GROUPS, budget=reduce.BUDGET):
+    '''Compute per-trial distance statistics for each condition group.
+
+    Parameters
+    ----------
+    data : ndarray
+        The dense (subject, block, trial, frame, column) dataset.
+    index : metadata.Index
+        Metadata for the trials of the dataset.
+    groups : sequence of (weight, hand), optional
+        Block conditions to select. Defaults to ``GROUPS``.
+    budget : int, optional
+        Read at most this many bytes of frame data at once.
+
+    Returns
+    -------
+    tables : OrderedDict
+        Maps each group to a structured array with dtype ``DTYPE`` and one
+        row per trial in the group.
+    '''
+    mean, std = reduce.map_trials(data, trial_stats, budget)
+
+    tables = collections.OrderedDict()
+    for weight, hand in groups:
+        rows = index.rows(block_weight=weight, block_hand=hand)
+        key = rows['subject'], rows['block'], rows['trial']
+        table = np.zeros(len(rows), DTYPE)
+        for name in ('subject', 'block', 'trial', 'trial-speed'):
+            table[name] = rows[name]
+        table['mean'] = mean[key]
+        table['std'] = std[key]
+        tables[weight, hand] = table
+    return tables
@@ -0,0 +1,192 @@
+'''Zero-phase low-pass filtering of the tracked points.
+
+Marker positions from the mocap system jitter from frame to frame. The
+functions here smooth the markers, finger and head of a batch of trials with
+a Butterworth filter in second-order sections, run forward and backward
+along the frame axis so the result has no phase lag:
+
+>>> smooth = filters.lowpass(trials, cutoff=10)
+
+A filter cannot run across a dropout, so each run of consecutive tracked
+frames of each series is filtered as a separate segment, and untracked
+samples are left as they are. All the segments of a batch are laid out as
+rows of one array and filtered in one call.
+
+Frames are recorded once per step of the target's movement, so the frame
+rate differs between trials. By default each trial is filtered at the rate
+given by its median frame interval; trials whose normalized cutoffs agree to
+three decimals share a filter and are processed together. To keep a
+filtered copy of a whole dataset on disk, use ``filters.cached``.
+'''
+
+import numpy as np
+
+from scipy import signal
+
+import constants as C
+
+# default cutoff frequency, in Hz.
+CUTOFF = 10
+
+# default order of the Butterworth filter.
+ORDER = 4
+
+
+def design(cutoff, rate, order=ORDER):
+    '''Design a low-pass Butterworth filter.
+
+    Parameters
+    ----------
+    cutoff : float
+        Cutoff frequency in Hz.
+    rate : float
+        Sample rate in Hz. The cutoff must be below half of it.
+    order : int, optional
+        Filter order. Defaults to ``ORDER``.
+
+    Returns
+    -------
+    sos : ndarray
+        The filter in second-order sections, with shape (section, 6).
+    '''
+    return signal.butter(order, 2. * cutoff / rate, output='sos')
+
+
+def rates(frames):
+    '''Get the sample rate of each trial, in Hz, from its median interval.'''
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return 1. / np.nanmedian(
+            np.diff(np.asarray(frames)[..., C.col('elapsed')], axis=-1), axis=-1)
+
+
+def _segments(valid):
+    # find runs of True in each row, as (row, start, length) arrays.
+    rows, frames = valid.shape
+    flat = np.concatenate([valid, np.zeros((rows, 1), bool)], axis=1).ravel()
+    edges = np.diff(np.concatenate([[0], flat.astype('i1')]))
+    starts = np.flatnonzero(edges == 1)
+    stops = np.flatnonzero(edges == -1)
+    return starts // (frames + 1), starts % (frames + 1), stops - starts
+
+
+def filtfilt(sos, values, valid):
+    '''Filter each run of valid samples of some series forward and backward.
+
+    Parameters
+    ----------
+    sos : ndarray
+        The filter in second-order sections, as returned by ``design``.
+    values : ndarray
+        Series with shape (series, frame).
+    valid : ndarray of bool
+        Which samples to use, with shape (series, frame).
+
+    Returns
+    -------
+    filtered : ndarray
+        A copy of ``values`` with the valid samples filtered.
+    '''
+    values = np.asarray(values, float)
+    filtered = values.copy()
+    row, start, length = _segments(valid)
+    if not len(row):
+        return filtered
+    # gather each segment into a row, padded at both ends by odd reflection
+    # like sosfiltfilt pads a single series, and aligned to the end of the
+    # row. The start of each row holds its first value, which leaves the
+    # filter in its initial steady state, so each segment is filtered exactly
+    # as if it were alone.
+    pad = np.minimum(3 * (2 * len(sos) + 1), length - 1)
+    width = (length + 2 * pad).max()
+    k = np.maximum(np.arange(width) - (width - length - pad)[:, None],
+                   -pad[:, None])
+    last = (length - 1)[:, None]
+    mirror = np.where(k < 0, -k, np.where(k > last, 2 * last - k, k))
+    segments = values[row[:, None], start[:, None] + mirror]
+    first = values[row, start][:, None]
+    end = values[row, start + length - 1][:, None]
+    segments = np.where(k < 0, 2 * first - segments,
+                        np.where(k > last, 2 * end - segments, segments))
+    segments = signal.sosfiltfilt(sos, segments, axis=-1, padlen=0)
+    keep = (k >= 0) & (k <= last)
+    filtered[np.broadcast_to(row[:, None], keep.shape)[keep],
+             (start[:, None] + k)[keep]] = segments[keep]
+    return filtered
+
+
+def lowpass(frames, cutoff=CUTOFF, order=ORDER, rate=None):
+    '''Low-pass filter the markers, finger and head of a batch of trials.
+
+    Parameters
+    ----------
+    frames : ndarray
+        Frames of data with shape (..., frame, 217).
+    cutoff : float, optional
+        Cutoff frequency in Hz. Defaults to ``CUTOFF``.
+    order : int, optional
+        Filter order. Defaults to ``ORDER``.
+    rate : float, optional
+        Sample rate in Hz. Defaults to the rate of each trial, from its
+        median frame interval.
+
+    Returns
+    -------
+    filtered : ndarray
+        A copy of the frames with the tracked positions filtered. Trials
+        whose rate is unknown, or too low for the cutoff, are not filtered.
+    '''
+    frames = np.asarray(frames)
+    filtered = frames.copy()
+    trials = filtered.reshape((-1, ) + frames.shape[-2:])
+    view = C.view(trials)
+    markers = view['markers']
+
+    # one series per trial and coordinate, with shape (trial, series, frame).
+    values = np.concatenate([
+        markers[..., :3].reshape(markers.shape[:2] + (-1, )),
+        view['finger'], view['head']], axis=-1).transpose((0, 2, 1))
+    tracked = np.concatenate([
+        np.repeat(markers[..., 3] > 0, 3, axis=-1),
+        np.ones(values.shape[:1] + values.shape[2:] + (6, ), bool)],
+        axis=-1).transpose((0, 2, 1)) & np.isfinite(values)
+
+    if rate is None:
+        rate = rates(trials)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        wn = np.round(2. * cutoff / np.broadcast_to(rate, len(trials)), 3)
+    for w in np.unique(wn[(wn > 0) & (wn < 1)]):
+        group = np.flatnonzero(wn == w)
+        sos = signal.butter(order, w, output='sos')
+        shape = values[group].shape
+        values[group] = filtfilt(
+            sos, values[group].reshape((-1, shape[-1])),
+            tracked[group].reshape((-1, shape[-1]))).reshape(shape)
+
+    values = values.transpose((0, 2, 1))
+    markers[..., :3] = values[..., :150].reshape(markers[..., :3].shape)
+    view['finger'][...] = values[..., 150:153]
+    view['head'][...] = values[..., 153:156]
+    return filtered
+
+
+def cached(cache, data, cutoff=CUTOFF, order=ORDER):
+    '''Get a low-pass filtered copy of a dense dataset from a cache.
+
+    Each cutoff and order is a separate cache entry, so filtering the
+    dataset again with other settings does not replace earlier copies.
+
+    Parameters
+    ----------
+    cache : cache.Cache
+        Cache of the dataset.
+    data : ndarray
+        The dense (subject, block, trial, frame, column) dataset.
+    cutoff, order :
+        See ``lowpass``.
+
+    Returns
+    -------
+    filtered : ndarray
+        A memory-mapped array with the shape of ``data``.
+    '''
+    return cache.derived(data, 'lowpass', lowpass, cutoff=cutoff, order=order)
@@ -0,0 +1,155 @@
+'''Fill short marker dropouts by interpolating along time.
+
+A marker drops out when its condition value is not positive; its position in
+those frames is meaningless. Here each dropout that is bounded by tracked
+frames on both sides, and no longer than a maximum number of frames, is
+filled by interpolating the marker's position on the ``elapsed`` time base.
+All markers of a batch of trials are filled at once:
+
+>>> filled, mask = gaps.fill(trials, max_gap=10)
+>>> util.valid(util.markers(filled))          # now True where mask is True
+
+Dropouts at the start or end of a trial, and longer dropouts, are left as
+they are. Filled samples get a condition value of ``FILLED``, so ``util.valid``
+treats them as tracked; the returned mask records which samples were filled.
+To keep a filled copy of a whole dataset on disk, use ``gaps.cached``, and
+recover the mask from the dataset and the copy with ``gaps.filled``.
+'''
+
+import numpy as np
+
+import constants as C
+
+# default longest dropout to fill, in frames.
+MAX_GAP = 10
+
+# condition value given to filled samples.
+FILLED = 1.0
+
+METHODS = ('linear', 'cubic')
+
+
+def _gather(values, index, axis):
+    # take values along a frame axis, clipping index to the valid range.
+    index = np.clip(index, 0, values.shape[axis] - 1)
+    return np.take_along_axis(values, index, axis=axis)
+
+
+def _slope(positions, times, a, b):
+    # slope between frames a and b of each marker, NaN where either is missing.
+    dp = _gather(positions, b[..., None], -3) - _gather(positions, a[..., None], -3)
+    dt = (_gather(times, b, -2) - _gather(times, a, -2))[..., None]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(dt > 0, dp / dt, np.nan)
+
+
+def fill(frames, method='linear', max_gap=MAX_GAP):
+    '''Fill marker dropouts in a batch of trials.
+
+    Parameters
+    ----------
+    frames : ndarray
+        Frames of data with shape (..., frame, 217).
+    method : str, optional
+        How to interpolate: 'linear' joins the tracked samples on either side
+        of a gap with a straight line; 'cubic' uses a cubic Hermite curve that
+        also matches the marker's velocity just outside the gap, falling back
+        to linear where that velocity is unknown. Defaults to 'linear'.
+    max_gap : int, optional
+        Longest dropout to fill, in frames. None fills gaps of any length.
+        Defaults to ``MAX_GAP``.
+
+    Returns
+    -------
+    filled : ndarray
+        A copy of the frames with the dropouts filled.
+    mask : ndarray of bool
+        Which samples were filled, with shape (..., frame, 50).
+    '''
+    if method not in METHODS:
+        raise ValueError('unknown interpolation method {!r}'.format(method))
+    frames = np.asarray(frames)
+    markers = C.view(frames)['markers']
+    positions = markers[..., :3].astype(float)
+    times = np.asarray(frames[..., C.col('elapsed')], float)
+    times = np.broadcast_to(times[..., None], markers.shape[:-1])
+    tracked = ((markers[..., 3] > 0) &
+               np.isfinite(positions).all(axis=-1) & np.isfinite(times))
+
+    # index of the nearest tracked frame at or before, and at or after, each
+    # frame; -1 and n mean there is none.
+    n = frames.shape[-2]
+    frame = np.arange(n)[:, None]
+    before = np.maximum.accumulate(np.where(tracked, frame, -1), axis=-2)
+    after = np.minimum.accumulate(
+        np.where(tracked, frame, n)[..., ::-1, :], axis=-2)[..., ::-1, :]
+    mask = ~tracked & (before >= 0) & (after < n) & np.isfinite(times)
+    if max_gap is not None:
+        mask &= after - before - 1 <= max_gap
+
+    p0 = _gather(positions, before[..., None], -3)
+    p1 = _gather(positions, after[..., None], -3)
+    t0 = _gather(times, before, -2)
+    t1 = _gather(times, after, -2)
+    h = (t1 - t0)[..., None]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        s = ((times - t0) / (t1 - t0))[..., None]
+    values = p0 + s * (p1 - p0)
+
+    if method == 'cubic':
+        secant = _slope(positions, times, before, after)
+        # velocities at the ends of the gap, from the frames just outside it.
+        m0 = _slope(positions, times, before - 1, before)
+        m0 = np.where(_gather(tracked, before - 1, -2)[..., None] &
+                      (before >= 1)[..., None] & np.isfinite(m0), m0, secant)
+        m1 = _slope(positions, times, after, after + 1)
+        m1 = np.where(_gather(tracked, after + 1, -2)[..., None] &
+                      (after < n - 1)[..., None] & np.isfinite(m1), m1, secant)
+        s2, s3 = s * s, s * s * s
+        values = ((2 * s3 - 3 * s2 + 1) * p0 + (s3 - 2 * s2 + s) * h * m0 +
+                  (3 * s2 - 2 * s3) * p1 + (s3 - s2) * h * m1)
+
+    filled = frames.copy()
+    out = C.view(filled)['markers']
+    out[..., :3] = np.where(mask[..., None], values, out[..., :3])
+    out[..., 3] = np.where(mask, FILLED, out[..., 3])
+    return filled, mask
+
+
+def filled(original, filled):
+    '''Recover the mask of filled samples from frames before and after filling.
+
+    Returns
+    -------
+    mask : ndarray of bool
+        Which samples are tracked in ``filled`` but not in ``original``, with
+        shape (..., frame, 50).
+    '''
+    before = C.view(original)['markers'][..., 3] > 0
+    after = C.view(filled)['markers'][..., 3] > 0
+    return after & ~before
+
+
+def cached(cache, data, method='linear', max_gap=MAX_GAP):
+    '''Get a filled copy of a dense dataset from a derived-array cache.
+
+    The copy is computed one subject at a time on first use and then read,
+    memory-mapped, from the cache.
+
+    Parameters
+    ----------
+    cache : cache.Cache
+        Cache of the dataset.
+    data : ndarray
+        The dense (subject, block, trial, frame, column) dataset.
+    method, max_gap :
+        See ``fill``.
+
+    Returns
+    -------
+    filled : ndarray
+        A memory-mapped array with the shape of ``data``.
+    '''
+    def kernel(frames, method, max_gap):
+        return fill(frames, method, max_gap)[0]
+    return cache.derived(data, 'gaps', kernel, method=method, max_gap=max_gap)
@@ -2,40 +2,79 @@ from __future__ import print_function
 
 import climate
 import numpy as np
-import os
-import re
 
-from constants import constants as C
+import columnar
+import compressed
+import ingest
+import metadata
+import quality
+import quantized
+import ragged
 
 logging = climate.get_logger('import-csvs')
 
 
-def main(root='/tmp/measurements', output=None):
-    data = []
-    for s in os.listdir(root):
-        subject = []
-        for b in os.listdir(os.path.join(root, s)):
-            block = []
-            bweight, bspeed, bhand, bpaths = b.split('-')[1:]
-            for t in os.listdir(os.path.join(root, s, b)):
-                thand, tspeed = re.search(r'(left|right)-speed_(\d\.\d+)', t).groups()
-                config = np.tile([
-                    C[bweight], C[bspeed], C[bhand], C[bpaths],
-                    C[thand], float(tspeed)], (120, 1))
-                block.append(
-                    np.hstack([
-                        config,
-                        np.loadtxt(os.path.join(root, s, b, t),
-                                   skiprows=1, delimiter=',')]))
-            subject.append(block)
-        if len(subject) == 3:
-            data.append(subject)
-        else:
-            print('incorrect block count! discarding {}'.format(s))
-    data = np.array(data)
-    logging.info('loaded data %s', data.shape)
-    if output:
+@climate.annotate(
+    root='directory containing subject measurements',
+    output='save imported dataset to this file or directory',
+    workers=('parse trial files using N worker processes', 'option', None, int),
+    stream=('write trials straight into a memmapped output file', 'flag'),
+    layout=('dataset layout: dense, ragged, columnar, compressed or quantized',
+            'option', None, str),
+    bits=('store quantized marker positions with 16 or 32 bits',
+          'option', None, int),
+    watch=('poll root every N seconds, importing new sessions (ragged only)',
+           'option', None, float),
+)
+def main(root='/tmp/measurements', output=None, workers=1, stream=False,
+         layout='dense', watch=0, bits=16):
+    if not output and layout != 'dense':
+        raise ValueError('--layout {} requires an output path'.format(layout))
+    if not output and stream:
+        raise ValueError('--stream requires an output path')
+    if layout == 'ragged':
+        if watch > 0:
+            ragged.watch(root, output, watch, workers)
+        dataset = ragged.update(root, output, workers)
+        logging.info('loaded %d trials, %d frames',
+                     len(dataset.trials) - 1, len(dataset.frames))
+        return
+    if watch > 0:
+        raise ValueError('--watch requires the ragged layout')
+
+    jobs = ingest.find_trials(root)
+    report = quality.Report(jobs)
+    if layout == 'columnar':
+        dataset = columnar.save(jobs, output, workers, report=report)
+        logging.info('loaded data %s', dataset.shape)
+    elif layout == 'quantized':
+        dataset = quantized.save(jobs, output, workers, bits, report)
+        logging.info('loaded %d trials, %d frames',
+                     len(dataset.trials) - 1, dataset.trials[-1])
+    elif layout == 'compressed':
+        container = compressed.save(jobs, output, workers, report=report)
+        logging.info('loaded %s trials', container.shape)
+    elif layout != 'dense':
+        raise ValueError('unknown layout "{}"'.format(layout))
+    elif stream:
+        data = ingest.stream_trials(jobs, output, workers, report=report)
+        logging.info('loaded data %s', data.shape)
+    else:
+        data = []
+        for job, frames in ingest.load_trials(jobs, workers, report):
+            if job.subject == len(data):
+                data.append([])
+            if job.block == len(data[job.subject]):
+                data[job.subject].append([])
+            data[job.subject][job.block].append(frames)
+        data = np.array(data)
+        logging.info('loaded data %s', data.shape)
+        if not output:
+            report.summarize()
+            return
         np.save(output, data.astype('f'))
+    metadata.save(jobs, output, report.table['frames'])
+    report.save(output)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,326 @@
+'''Helpers for importing trial CSV files from a measurement tree.'''
+
+import climate
+import collections
+import multiprocessing
+import numpy as np
+import os
+import re
+import time
+
+import constants as C
+
+logging = climate.get_logger('ingest')
+
+# one trial file to import, with its (subject, block, trial) position in the
+# output dataset and the configuration values parsed from its path.
+Job = collections.namedtuple('Job', 'subject block trial path config')
+
+
+def trial_config(block, trial):
+    '''Parse the block and trial configuration encoded in file names.
+
+    Parameters
+    ----------
+    block : str
+        Name of the block directory, like "block1-UNWEIGHTED-SLOW-...".
+    trial : str
+        Name of the trial file, like "...-right-speed_0.512.csv".
+
+    Returns
+    -------
+    config : list of float
+        Values for the six configuration columns of the dataset.
+    '''
+    bweight, bspeed, bhand, bpaths = block.split('-')[1:]
+    thand, tspeed = re.search(r'(left|right)-speed_(\d\.\d+)', trial).groups()
+    return [C.CONSTANTS[bweight], C.CONSTANTS[bspeed], C.CONSTANTS[bhand],
+            C.CONSTANTS[bpaths], C.CONSTANTS[thand], float(tspeed)]
+
+
+def path_name(trial):
+    '''Get the name of the path traced in a trial, from its file name.
+
+    Trial files are named like "<stamp>-<path>-right-speed_0.512.csv", where
+    the path is the name of a file in vizard/paths (without ".txt").
+    '''
+    match = re.match(r'\d+-(.+)-(left|right)-speed_', os.path.basename(trial))
+    return match.group(1) if match else ''
+
+
+def find_trials(root):
+    '''Walk a measurement tree and list the trial files to import.
+
+    Subjects, blocks and trials are visited in sorted order, so the position
+    of each trial in the output does not depend on the file system. Subjects
+    with an unexpected number of blocks are discarded.
+
+    Parameters
+    ----------
+    root : str
+        Directory containing one subdirectory per subject.
+
+    Returns
+    -------
+    jobs : list of Job
+        One job per trial file, in subject/block/trial order.
+    '''
+    jobs = []
+    s = 0
+    for subject in sorted(os.listdir(root)):
+        blocks = sorted(os.listdir(os.path.join(root, subject)))
+        if len(blocks) != 3:
+            logging.warning('discarding %s: expected 3 blocks, found %d',
+                            subject, len(blocks))
+            continue
+        for b, block in enumerate(blocks):
+            trials = sorted(os.listdir(os.path.join(root, subject, block)))
+            for t, trial in enumerate(trials):
+                jobs.append(Job(s, b, t,
+                                os.path.join(root, subject, block, trial),
+                                trial_config(block, trial)))
+        s += 1
+    return jobs
+
+
+def count_frames(path):
+    '''Count the data rows in a trial file without parsing them.'''
+    lines = 0
+    last = b'\n'
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b''):
+            lines += chunk.count(b'\n')
+            last = chunk[-1:]
+    if last != b'\n':
+        lines += 1
+    return lines - 1
+
+
+def dataset_shape(jobs):
+    '''Compute the shape of the dense array holding a list of trials.
+
+    Only the file names and line counts are inspected; no values are parsed.
+
+    Parameters
+    ----------
+    jobs : list of Job
+        Trials to import.
+
+    Returns
+    -------
+    shape : tuple of int
+        Shape of the (subject, block, trial, frame, column) dataset.
+    '''
+    return (1 + max(j.subject for j in jobs),
+            1 + max(j.block for j in jobs),
+            1 + max(j.trial for j in jobs),
+            max(count_frames(j.path) for j in jobs),
+            len(C.COLUMNS))
+
+
+# maps the header of a trial file to dataset column indices.
+_HEADERS = {}
+
+
+def header_columns(header):
+    '''Map the fields in a trial file header to dataset columns.
+
+    Trial files name their fields like "elapsed_time", "target_x" or "13_c"
+    (see ``Trial.write_records`` in vizard/main.py); these are mapped to the
+    names in ``constants.COLUMNS``, like "elapsed", "target-x" or "m013-c".
+
+    Parameters
+    ----------
+    header : str
+        First line of a trial file.
+
+    Returns
+    -------
+    columns : ndarray of int
+        Index in ``constants.COLUMNS`` of each field in the file.
+    '''
+    if header not in _HEADERS:
+        columns = []
+        for field in header.strip().split(','):
+            name, _, suffix = field.strip().rpartition('_')
+            if name.isdigit():
+                name = 'm{:03d}'.format(int(name))
+            if name == 'elapsed':
+                columns.append(C.col('elapsed'))
+            elif name:
+                columns.append(C.col('{}-{}'.format(name, suffix)))
+            else:
+                columns.append(C.col(suffix))
+        _HEADERS[header] = np.array(columns)
+    return _HEADERS[header]
+
+
+def _parse_loadtxt(handle, columns):
+    return np.loadtxt(handle, delimiter=',', ndmin=2).reshape((-1, columns))
+
+
+def _parse_fromstring(handle, columns):
+    flat = np.fromstring(handle.read().replace(',', ' '), sep=' ')
+    if flat.size % columns:
+        raise ValueError('could not parse {} values into {} columns'.format(
+            flat.size, columns))
+    return flat.reshape((-1, columns))
+
+
+# functions that parse the body of a trial file into rows of values.
+PARSERS = {'loadtxt': _parse_loadtxt, 'fromstring': _parse_fromstring}
+
+# np.loadtxt only tokenizes in C from numpy 1.23; before that, converting the
+# whole body with np.fromstring is much faster. Run bench-csv.py to compare.
+PARSER = ('loadtxt' if tuple(int(v) for v in np.__version__.split('.')[:2])
+          >= (1, 23) else 'fromstring')
+
+
+def read_trial(path, parser=None):
+    '''Read the values in a trial file into dataset columns.
+
+    The header is mapped to dataset columns with ``header_columns``, and the
+    body of the file is parsed in one call to a C-level parser.
+
+    Parameters
+    ----------
+    path : str
+        Name of a trial CSV file.
+    parser : str, optional
+        Name of the body parser in ``PARSERS``. Defaults to ``PARSER``, the
+        faster one for the installed numpy.
+
+    Returns
+    -------
+    values : ndarray
+        An array of shape (frames, len(constants.COLUMNS)) holding the values
+        in the file. Columns that are not in the file (the config columns, and
+        any markers that were not tracked) are NaN.
+    '''
+    with open(path) as handle:
+        columns = header_columns(handle.readline())
+        try:
+            parsed = PARSERS[parser or PARSER](handle, len(columns))
+        except ValueError as error:
+            raise ValueError('{}: {}'.format(path, error))
+    values = np.empty((len(parsed), len(C.COLUMNS)))
+    values.fill(np.nan)
+    values[:, columns] = parsed
+    return values
+
+
+def load_trial(job):
+    '''Load the frames for one trial, including its config columns.'''
+    values = read_trial(job.path)
+    values[:, :len(job.config)] = job.config
+    return values
+
+
+def _timed_load_trial(args):
+    job, measure = args
+    start = time.time()
+    frames = load_trial(job)
+    metrics = measure(frames) if measure else None
+    return os.getpid(), time.time() - start, frames, metrics
+
+
+def load_trials(jobs, workers=1, report=None):
+    '''Load a sequence of trials, optionally using a pool of processes.
+
+    Trials are yielded in the same order as the jobs, whatever the number of
+    workers. Once the last trial is loaded, per-worker throughput is logged.
+
+    Parameters
+    ----------
+    jobs : list of Job
+        Trials to load.
+    workers : int, optional
+        Number of worker processes. Defaults to 1, which loads trials
+        serially in the current process.
+    report : quality.Report, optional
+        If given, the quality metrics of each trial are computed as it is
+        loaded, and added to this report.
+
+    Returns
+    -------
+    trials : generator of (Job, ndarray)
+        Each job paired with the frame array it loaded.
+    '''
+    measure = report.measure if report is not None else None
+    args = [(job, measure) for job in jobs]
+    pool = None
+    results = (_timed_load_trial(a) for a in args)
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        chunksize = max(1, len(jobs) // (4 * workers))
+        results = pool.imap(_timed_load_trial, args, chunksize)
+
+    start = time.time()
+    stats = collections.defaultdict(lambda: [0, 0, 0.])
+    try:
+        for n, job in enumerate(jobs):
+            pid, elapsed, frames, metrics = next(results)
+            if report is not None:
+                report.add(job, metrics)
+            stat = stats[pid]
+            stat[0] += 1
+            stat[1] += len(frames)
+            stat[2] += elapsed
+            if n == len(jobs) - 1:
+                _log_throughput(stats, time.time() - start, workers)
+            yield job, frames
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+def _log_throughput(stats, elapsed, workers):
+    for pid, (count, rows, seconds) in sorted(stats.items()):
+        logging.info('worker %d: %d trials, %d frames in %.1fs (%.1f trials/s)',
+                     pid, count, rows, seconds, count / max(seconds, 1e-9))
+    count = sum(stat[0] for stat in stats.values())
+    logging.info('loaded %d trials with %d workers in %.1fs (%.1f trials/s)',
+                 count, max(1, workers), elapsed, count / max(elapsed, 1e-9))
+
+
+def stream_trials(jobs, output, workers=1, dtype='f', report=None):
+    '''Load trials straight into a memory-mapped .npy file.
+
+    A first pass over the trial files sizes the output, which is then opened
+    with ``np.lib.format.open_memmap``. Each trial is written into its slot as
+    soon as it is parsed, so only a few trials are ever held in memory. Slots
+    with no data (short trials, or blocks with fewer trials) are NaN.
+
+    Parameters
+    ----------
+    jobs : list of Job
+        Trials to import.
+    output : str
+        Name of the .npy file to write.
+    workers : int, optional
+        Number of worker processes used to parse trial files.
+    dtype : str, optional
+        Data type of the output array. Defaults to float32.
+    report : quality.Report, optional
+        Add the quality metrics of each trial to this report.
+
+    Returns
+    -------
+    data : memmap
+        The dataset array, backed by the output file.
+    '''
+    shape = dataset_shape(jobs)
+    logging.info('writing %s to %s', shape, output)
+    data = np.lib.format.open_memmap(output, mode='w+', dtype=dtype, shape=shape)
+    filled = set()
+    for job, frames in load_trials(jobs, workers, report):
+        slot = data[job.subject, job.block, job.trial]
+        slot[:len(frames)] = frames
+        slot[len(frames):] = np.nan
+        filled.add((job.subject, job.block, job.trial))
+    for index in np.ndindex(*shape[:3]):
+        if index not in filled:
+            data[index] = np.nan
+    data.flush()
+    return data
@@ -0,0 +1,144 @@
+'''Velocity, acceleration and jerk of the tracked points.
+
+Frames are recorded once per step of the target's movement, so the time
+between frames varies. Derivatives here are taken with respect to the
+``elapsed`` column of each frame, using second-order finite differences on
+the non-uniform time base. They are computed for the target, finger and head
+and for all 50 markers of a batch of trials in one pass:
+
+>>> velocity, acceleration, jerk = kinematics.derivatives(trials)
+>>> speed = np.linalg.norm(velocity[..., kinematics.POINTS.index('finger'), :],
+...                        axis=-1)
+
+Untracked markers, padding frames and frames whose elapsed time does not
+increase give NaN. To keep derivatives of a whole dataset on disk, use
+``kinematics.cached``.
+'''
+
+import numpy as np
+
+import constants as C
+
+# names of the points with derivatives, in order.
+POINTS = ('target', 'finger', 'head') + tuple(
+    'm{:03d}'.format(m) for m in range(50))
+
+
+def positions(frames):
+    '''Get the positions of all points in ``POINTS``.
+
+    Parameters
+    ----------
+    frames : ndarray
+        Frames of data with shape (..., 217).
+
+    Returns
+    -------
+    positions : ndarray
+        An array with shape (..., 53, 3). Untracked markers are NaN.
+    '''
+    view = C.view(frames)
+    markers = view['markers']
+    tracked = (markers[..., 3] > 0)[..., None]
+    return np.concatenate([
+        np.stack([view['target'], view['finger'], view['head']], axis=-2),
+        np.where(tracked, markers[..., :3], np.nan),
+    ], axis=-2)
+
+
+def derivative(values, times):
+    '''Differentiate values sampled at non-uniform times.
+
+    Interior frames use the second-order central difference for uneven
+    spacing, which is the average of the backward and forward slopes weighted
+    by the opposite interval. Where only one neighbor is valid (at the ends
+    of a trial, or next to a gap), its one-sided slope is used.
+
+    Parameters
+    ----------
+    values : ndarray
+        Values with shape (..., frame, ...), where the leading axes match
+        those of ``times``.
+    times : ndarray
+        Sample times with shape (..., frame).
+
+    Returns
+    -------
+    derivative : ndarray
+        An array with the shape of ``values``.
+    '''
+    values = np.asarray(values, float)
+    times = np.asarray(times, float)
+    axis = times.ndim - 1
+    times = times.reshape(times.shape + (1, ) * (values.ndim - times.ndim))
+    dt = np.diff(times, axis=axis)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = np.where(dt > 0, np.diff(values, axis=axis) / dt, np.nan)
+
+    def pad(x, before):
+        shape = list(x.shape)
+        shape[axis] = 1
+        edge = np.full(shape, np.nan)
+        return np.concatenate([edge, x] if before else [x, edge], axis=axis)
+
+    back, ahead = pad(slope, True), pad(slope, False)
+    hb, ha = pad(dt, True), pad(dt, False)
+    with np.errstate(invalid='ignore'):
+        central = (ha * back + hb * ahead) / (hb + ha)
+    return np.where(np.isfinite(central), central,
+                    np.where(np.isfinite(back), back, ahead))
+
+
+def derivatives(frames, order=3):
+    '''Compute velocity, acceleration and jerk for a batch of trials.
+
+    Parameters
+    ----------
+    frames : ndarray
+        Frames of data with shape (..., frame, 217).
+    order : int, optional
+        Number of derivatives to compute. Defaults to 3.
+
+    Returns
+    -------
+    derivatives : list of ndarray
+        The first ``order`` derivatives of the positions of ``POINTS``, in
+        meters per second, meters per second squared and so on. Each has
+        shape (..., frame, 53, 3).
+    '''
+    times = np.asarray(frames)[..., C.col('elapsed')]
+    values = positions(frames)
+    result = []
+    for _ in range(order):
+        values = derivative(values, times)
+        result.append(values)
+    return result
+
+
+def stacked(frames, order=3):
+    '''Get the derivatives of a batch of trials as one array.
+
+    The result has shape (..., frame, order, 53, 3).
+    '''
+    return np.stack(derivatives(frames, order), axis=-3)
+
+
+def cached(cache, data, order=3):
+    '''Get the derivatives of a dense dataset from a derived-array cache.
+
+    Parameters
+    ----------
+    cache : cache.Cache
+        Cache of the dataset.
+    data : ndarray
+        The dense (subject, block, trial, frame, column) dataset.
+    order : int, optional
+        Number of derivatives. Defaults to 3.
+
+    Returns
+    -------
+    derivatives : ndarray
+        A memory-mapped array with shape (subject, block, trial, frame,
+        order, 53, 3).
+    '''
+    return cache.derived(data, 'kinematics', stacked, order=order)
@@ -0,0 +1,151 @@
+'''Lags between tracked points, from FFT cross-correlations.
+
+For each trial and each pair of tracked points (by default the pairs in
+``errors.PAIRS``), the centered trajectories are cross-correlated with one
+batched FFT, summing the correlations of the x, y and z columns. The lag with
+the largest correlation is how many frames the second point trails the
+first; shifting the second point back by that lag gives the lag-corrected
+tracing error:
+
+>>> table = reduce.map_trials(data, lags.trial_lags)
+>>> table['lag'][..., errors.PAIRS.index(('target', 'finger'))]
+
+Points can be column groups like "finger", or single columns like
+"finger-y", as long as both points of a pair have the same number of columns.
+'''
+
+import numpy as np
+
+import constants as C
+import errors
+
+
+def dtype(pairs=errors.PAIRS):
+    '''Get the dtype of a lag table with one row per trial.'''
+    return np.dtype([
+        # frames by which the second point of each pair trails the first.
+        ('lag', 'i4', (len(pairs), )),
+        # the same lag in seconds, using the median frame interval.
+        ('delay', 'f4', (len(pairs), )),
+        # normalized cross-correlation at the lag.
+        ('correlation', 'f4', (len(pairs), )),
+        # mean distance in mm between the points, after removing the lag.
+        ('error', 'f4', (len(pairs), )),
+    ])
+
+
+def _columns(name):
+    if name in C.COLUMN_GROUPS:
+        columns = C.COLUMN_GROUPS[name]
+        return list(range(columns.start, columns.stop))
+    return [C.col(name)]
+
+
+def correlate(src, tgt, max_lag=None):
+    '''Find the lag that best aligns two batches of trajectories.
+
+    Parameters
+    ----------
+    src, tgt : ndarray
+        Trajectories with shape (..., frame, dim). Frames where either has a
+        NaN value are ignored.
+    max_lag : int, optional
+        Only consider lags up to this many frames in either direction.
+        Defaults to half the number of frames.
+
+    Returns
+    -------
+    lag : ndarray of int
+        Number of frames by which ``tgt`` trails ``src``, with shape (...).
+    correlation : ndarray
+        Cross-correlation at that lag, normalized by the energy of the
+        overlapping frames, between -1 and 1.
+    '''
+    valid = (np.isfinite(src).all(axis=-1) &
+             np.isfinite(tgt).all(axis=-1))[..., None]
+    count = np.maximum(1, valid.sum(axis=-2))[..., None, :]
+
+    def center(x):
+        mean = np.where(valid, x, 0).sum(axis=-2)[..., None, :] / count
+        return np.where(valid, x - mean, 0)
+
+    a, b = center(src), center(tgt)
+    frames = src.shape[-2]
+    size = 2 ** int(np.ceil(np.log2(max(2, 2 * frames - 1))))
+    spectrum = np.conj(np.fft.rfft(a, size, axis=-2)) * np.fft.rfft(b, size, axis=-2)
+    # entry k of the circular correlation is sum_t a[t] b[t + k], so negative
+    # lags wrap around to the end.
+    cc = np.fft.irfft(spectrum.sum(axis=-1), size, axis=-1)
+    if max_lag is None:
+        max_lag = frames // 2
+    max_lag = min(max_lag, frames - 1)
+    lags = np.arange(-max_lag, max_lag + 1)
+    cc = cc[..., lags]
+
+    # normalize each lag by the energy of the frames that overlap at that lag,
+    # assuming the valid frames of each trial come first.
+    n = valid[..., 0].sum(axis=-1)[..., None]
+    zero = np.zeros(a.shape[:-2] + (1, ))
+    ea = np.concatenate([zero, np.cumsum((a * a).sum(axis=-1), axis=-1)], axis=-1)
+    eb = np.concatenate([zero, np.cumsum((b * b).sum(axis=-1), axis=-1)], axis=-1)
+    def energy(e, start, stop):
+        return (np.take_along_axis(e, np.clip(stop, 0, frames), axis=-1) -
+                np.take_along_axis(e, np.clip(start, 0, frames), axis=-1))
+    # at lag k, frames [lo, hi) of a overlap frames [lo + k, hi + k) of b.
+    hi = np.minimum(n, n - lags)
+    lo = np.broadcast_to(np.maximum(0, -lags), hi.shape)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cc = cc / np.sqrt(energy(ea, lo, hi) * energy(eb, lo + lags, hi + lags))
+    cc[~np.isfinite(cc)] = -np.inf
+    best = cc.argmax(axis=-1)
+    peak = np.take_along_axis(cc, best[..., None], axis=-1)[..., 0]
+    return lags[best], np.where(np.isfinite(peak), peak, np.nan)
+
+
+def shifted_error(src, tgt, lag):
+    '''Get the mean distance in mm between src and tgt shifted back by lag.'''
+    frames = src.shape[-2]
+    index = np.arange(frames) + lag[..., None]
+    inside = (index >= 0) & (index < frames)
+    index = np.clip(index, 0, frames - 1)
+    shifted = np.take_along_axis(tgt, index[..., None], axis=-2)
+    d = 1000 * np.sqrt(((src - shifted) ** 2).sum(axis=-1))
+    ok = inside & np.isfinite(d)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(ok, d, 0).sum(axis=-1) / ok.sum(axis=-1)
+
+
+def trial_lags(frames, pairs=errors.PAIRS, max_lag=None):
+    '''Estimate the lag between each pair of points in a batch of trials.
+
+    Parameters
+    ----------
+    frames : ndarray
+        Frames of data with shape (..., frame, 217), with NaN padding frames.
+    pairs : sequence of (str, str), optional
+        Pairs of column groups or column names. Defaults to ``errors.PAIRS``.
+    max_lag : int, optional
+        Largest lag to consider, in frames. Defaults to half the number of
+        frames.
+
+    Returns
+    -------
+    table : ndarray
+        A structured array with shape (...) and dtype ``dtype(pairs)``.
+    '''
+    table = np.zeros(frames.shape[:-2], dtype(pairs))
+    with np.errstate(invalid='ignore'):
+        interval = np.nanmedian(np.diff(frames[..., C.col('elapsed')], axis=-1),
+                                axis=-1)
+    for i, (src, tgt) in enumerate(pairs):
+        src, tgt = _columns(src), _columns(tgt)
+        if len(src) != len(tgt):
+            raise ValueError('cannot correlate {} with {} columns'.format(
+                len(src), len(tgt)))
+        a, b = frames[..., src], frames[..., tgt]
+        lag, peak = correlate(a, b, max_lag)
+        table['lag'][..., i] = lag
+        table['delay'][..., i] = lag * interval
+        table['correlation'][..., i] = peak
+        table['error'][..., i] = shifted_error(a, b, lag)
+    return table
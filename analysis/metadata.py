@@ -0,0 +1,175 @@
+'''Per-trial metadata, stored apart from the frame data.
+
+The importer writes a small table with one row per trial next to each
+dataset, holding the position of the trial in the dataset, its block and
+trial configuration, its frame count and the name of the path it traced.
+Selecting trials by condition then only reads this table, without touching any
+frame data:
+
+>>> index = metadata.for_dataset('measurements.npy')
+>>> for s, b, t in zip(*index.where(block_weight=C.UNWEIGHTED,
+...                                 block_hand=C.DOMINANT)):
+...     trial = data[s, b, t]
+
+For datasets stored in a directory, the table is saved as ``meta.npy`` in that
+directory; otherwise it is saved beside the dataset, so the table for
+``measurements.npy`` is ``measurements-meta.npy``.
+'''
+
+import climate
+import numpy as np
+import os
+
+import constants as C
+import ingest
+
+logging = climate.get_logger('metadata')
+
+CONFIG = C.COLUMNS[:6]
+
+DTYPE = np.dtype(
+    [('subject', 'i4'), ('block', 'i4'), ('trial', 'i4')] +
+    [(name, 'f4') for name in CONFIG] +
+    [('frames', 'i4'), ('path', 'S16')])
+
+
+def path_for(dataset, name='meta'):
+    '''Get the name of a per-trial table stored with a dataset.'''
+    if os.path.isdir(dataset):
+        return os.path.join(dataset, name + '.npy')
+    return '{}-{}.npy'.format(os.path.splitext(dataset)[0], name)
+
+
+def build(jobs, counts=None):
+    '''Build the metadata table for a list of trials to import.
+
+    Parameters
+    ----------
+    jobs : list of ingest.Job
+        Trials being imported.
+    counts : sequence of int, optional
+        Number of frames in each trial, if the importer already knows them
+        (for example from a ``quality.Report``). Otherwise the lines of each
+        trial file are counted.
+
+    Returns
+    -------
+    table : ndarray
+        A structured array with dtype ``DTYPE`` and one row per trial.
+    '''
+    table = np.zeros(len(jobs), DTYPE)
+    if counts is None:
+        counts = [ingest.count_frames(job.path) for job in jobs]
+    table['frames'] = counts
+    for row, job in zip(table, jobs):
+        row['subject'] = job.subject
+        row['block'] = job.block
+        row['trial'] = job.trial
+        for name, value in zip(CONFIG, job.config):
+            row[name] = value
+        row['path'] = ingest.path_name(job.path).encode('ascii')
+    return table
+
+
+def save(jobs, dataset, counts=None):
+    '''Write the metadata table for trials imported into a dataset.
+
+    See ``build`` for the arguments.
+    '''
+    table = build(jobs, counts)
+    np.save(path_for(dataset), table)
+    logging.info('wrote metadata for %d trials to %s',
+                 len(table), path_for(dataset))
+    return Index(table)
+
+
+def from_dense(data):
+    '''Build the metadata table by scanning a dense dataset.
+
+    This reads the first frame of every trial, and the frame column of every
+    frame, so it is only meant for datasets imported without a table. Path
+    names are not stored in the dataset, so they are left empty.
+    '''
+    shape = data.shape[:3]
+    table = np.zeros(int(np.prod(shape)), DTYPE)
+    table['subject'], table['block'], table['trial'] = [
+        i.ravel() for i in np.indices(shape)]
+    first = np.asarray(data[:, :, :, 0, :len(CONFIG)]).reshape((-1, len(CONFIG)))
+    for i, name in enumerate(CONFIG):
+        table[name] = first[:, i]
+    frames = np.isfinite(data[..., C.col('frame')]).sum(axis=-1)
+    table['frames'] = frames.ravel()
+    return table
+
+
+def for_dataset(dataset, data=None):
+    '''Load the metadata index for a dataset.
+
+    Parameters
+    ----------
+    dataset : str
+        Name of the dataset file or directory.
+    data : ndarray, optional
+        The dense dataset array. If the dataset has no metadata table, one is
+        built from this array and saved.
+
+    Returns
+    -------
+    index : Index
+        The metadata index for the dataset.
+    '''
+    path = path_for(dataset)
+    if not os.path.exists(path):
+        if data is None:
+            raise IOError('no metadata table {}'.format(path))
+        logging.info('building metadata table %s', path)
+        np.save(path, from_dense(data))
+    return Index(np.load(path))
+
+
+class Index(object):
+    '''Query trials by condition using a metadata table.
+
+    Parameters
+    ----------
+    table : ndarray
+        A structured array with dtype ``DTYPE``.
+    '''
+
+    def __init__(self, table):
+        self.table = table
+
+    def __len__(self):
+        return len(self.table)
+
+    def mask(self, **conditions):
+        '''Get a boolean mask of the trials matching some conditions.
+
+        Each keyword names a field of the table, with underscores in place of
+        dashes (for example ``trial_speed`` for "trial-speed"). Its value can
+        be a single value, a list or tuple of allowed values, or a callable
+        that takes an array of field values and returns a boolean mask.
+        '''
+        mask = np.ones(len(self.table), bool)
+        for key, value in conditions.items():
+            field = self.table[key.replace('_', '-')]
+            if callable(value):
+                mask &= value(field)
+            elif isinstance(value, (list, tuple)):
+                mask &= np.in1d(field, value)
+            else:
+                mask &= field == value
+        return mask
+
+    def where(self, **conditions):
+        '''Get the (subject, block, trial) indices of matching trials.
+
+        The result is a tuple of three integer arrays, which can be used to
+        index a dense dataset directly. See ``mask`` for the conditions.
+        '''
+        rows = self.table[self.mask(**conditions)]
+        return rows['subject'], rows['block'], rows['trial']
+
+    def rows(self, **conditions):
+        '''Get the metadata rows of the trials matching some conditions.'''
+        return self.table[self.mask(**conditions)]
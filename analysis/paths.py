@@ -0,0 +1,214 @@
+'''Tracing error measured against the geometry of the traced path.
+
+The distance between the finger and the moving target counts a finger that is
+on the path, but a little behind the target, as a large error. Here each
+finger sample is instead projected onto the path it traced, and its error is
+split into two parts:
+
+- cross-path deviation, the distance from the finger to the nearest point on
+  the path, and
+- along-path lag, the distance along the path from that point to the
+  target's own projection, positive when the finger trails the target.
+
+Paths are read from ``vizard/paths`` and scaled and translated like
+``Block.load_path`` does in the experiment. Paths are drawn as closed loops,
+so the random starting vertex and direction chosen for each trial do not
+change their shape; the direction of travel is recovered from the target.
+
+>>> path = paths.Path.load('1395118346')
+>>> deviation, lag = path.decompose(trials)
+'''
+
+import climate
+import numpy as np
+import os
+
+from scipy.spatial import cKDTree
+
+import constants as C
+
+logging = climate.get_logger('paths')
+
+# directory holding the path files used in the experiment.
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                    os.pardir, 'vizard', 'paths')
+
+# scaling and translation applied to path files in the experiment.
+SCALE = 0.7, 0.7, 0.7
+TRANSLATE = 0, 1.3, 0
+
+
+def load(name, root=ROOT, scale=SCALE, translate=TRANSLATE):
+    '''Load the vertices of a path, as placed in the experiment.
+
+    Returns
+    -------
+    vertices : ndarray
+        An array with shape (vertex, 3).
+    '''
+    vertices = []
+    with open(os.path.join(root, '{}.txt'.format(name))) as handle:
+        for line in handle:
+            try:
+                x, y, z = map(float, line.strip().split('#')[0].strip().split())
+            except ValueError:
+                continue
+            vertices.append((x, y, z))
+    return np.array(vertices) * scale + translate
+
+
+class Path(object):
+    '''A closed polyline, indexed for nearest-point queries.
+
+    The midpoints of the segments are kept in a k-d tree. A point's nearest
+    segment is found among the segments with the nearest midpoints; a point
+    is only compared with every segment when that search cannot guarantee
+    the result, which happens for points far from short segments.
+
+    Parameters
+    ----------
+    vertices : ndarray
+        Vertices of the path, with shape (vertex, 3). The last vertex joins
+        the first.
+    neighbors : int, optional
+        Number of candidate segments to check for each point. Defaults to 8.
+    '''
+
+    def __init__(self, vertices, neighbors=8):
+        self.start = np.asarray(vertices, float)
+        self.delta = np.roll(self.start, -1, axis=0) - self.start
+        self.lengths = np.sqrt((self.delta ** 2).sum(axis=1))
+        self.offsets = np.concatenate([[0], np.cumsum(self.lengths)[:-1]])
+        self.length = self.lengths.sum()
+        self.neighbors = min(neighbors, len(self.start))
+        self.reach = self.lengths.max() / 2
+        self.tree = cKDTree(self.start + self.delta / 2)
+
+    @classmethod
+    def load(cls, name, **kwargs):
+        '''Load a path by name; see the ``load`` function for arguments.'''
+        return cls(load(name, **kwargs))
+
+    def _project(self, points, segments):
+        # nearest point to each point on each of its candidate segments.
+        start = self.start[segments]
+        delta = self.delta[segments]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            t = (((points[:, None] - start) * delta).sum(axis=-1) /
+                 (delta ** 2).sum(axis=-1))
+        t = np.clip(np.nan_to_num(t), 0, 1)
+        dist = np.sqrt(((start + t[..., None] * delta - points[:, None]) ** 2)
+                       .sum(axis=-1))
+        best = dist.argmin(axis=1)
+        rows = np.arange(len(points))
+        segment = segments[rows, best]
+        arc = self.offsets[segment] + t[rows, best] * self.lengths[segment]
+        return dist[rows, best], arc
+
+    def project(self, points):
+        '''Find the nearest point on the path to each of some points.
+
+        Parameters
+        ----------
+        points : ndarray
+            Points with shape (..., 3). NaN points give NaN results.
+
+        Returns
+        -------
+        distance : ndarray
+            Distance in meters from each point to the path, with shape (...).
+        arc : ndarray
+            Arc length along the path, from its first vertex, of the nearest
+            point on the path.
+        '''
+        points = np.asarray(points, float)
+        flat = points.reshape((-1, 3))
+        distance = np.full(len(flat), np.nan)
+        arc = np.full(len(flat), np.nan)
+        ok = np.isfinite(flat).all(axis=1)
+        query = flat[ok]
+        near, segments = self.tree.query(query, self.neighbors)
+        near = near.reshape((len(query), -1))
+        segments = segments.reshape((len(query), -1))
+        d, a = self._project(query, segments)
+        # any segment not checked is at least (midpoint distance - half its
+        # length) away, so check all segments where that could beat d.
+        unsure = near[:, -1] - self.reach < d
+        if unsure.any() and self.neighbors < len(self.start):
+            every = np.tile(np.arange(len(self.start)), (unsure.sum(), 1))
+            d[unsure], a[unsure] = self._project(query[unsure], every)
+        distance[ok] = d
+        arc[ok] = a
+        return distance.reshape(points.shape[:-1]), arc.reshape(points.shape[:-1])
+
+    def wrap(self, arc):
+        '''Wrap arc length differences into [-length / 2, length / 2).'''
+        half = self.length / 2
+        return (arc + half) % self.length - half
+
+    def decompose(self, frames):
+        '''Split the finger's tracing error into cross- and along-path parts.
+
+        Parameters
+        ----------
+        frames : ndarray
+            Frames of data with shape (..., frame, 217), for trials that all
+            traced this path.
+
+        Returns
+        -------
+        deviation : ndarray
+            Distance in mm from the finger to the path, with shape
+            (..., frame).
+        lag : ndarray
+            Distance in mm along the path from the finger to the target,
+            positive when the finger trails the target.
+        '''
+        view = C.view(frames)
+        deviation, finger = self.project(view['finger'])
+        _, target = self.project(view['target'])
+        # the target moves forward or backward along the path in each trial.
+        with np.errstate(invalid='ignore'):
+            direction = np.sign(np.nansum(
+                self.wrap(np.diff(target, axis=-1)), axis=-1))[..., None]
+        lag = direction * self.wrap(target - finger)
+        return 1000 * deviation, 1000 * lag
+
+
+def decompose(data, index, root=ROOT):
+    '''Decompose the tracing error of every trial in a dense dataset.
+
+    Trials are grouped by the path they traced, using the path names in the
+    metadata table, and each group is processed in one batch.
+
+    Parameters
+    ----------
+    data : ndarray
+        The dense (subject, block, trial, frame, column) dataset.
+    index : metadata.Index
+        Metadata for the trials of the dataset.
+    root : str, optional
+        Directory holding the path files.
+
+    Returns
+    -------
+    deviation, lag : ndarray
+        Arrays with shape (subject, block, trial, frame), in mm. Trials with
+        no known path are NaN.
+    '''
+    deviation = np.full(data.shape[:4], np.nan, 'f')
+    lag = np.full(data.shape[:4], np.nan, 'f')
+    table = index.table
+    if 'path' not in table.dtype.names:
+        raise ValueError('metadata has no path names; import the dataset again')
+    for name in np.unique(table['path']):
+        if not name:
+            continue
+        rows = table[table['path'] == name]
+        key = rows['subject'], rows['block'], rows['trial']
+        path = Path.load(name.decode('ascii'), root=root)
+        deviation[key], lag[key] = path.decompose(np.asarray(data[key]))
+    missing = (table['path'] == b'').sum()
+    if missing:
+        logging.warning('%d trials have no path name in their metadata', missing)
+    return deviation, lag
@@ -4,70 +4,69 @@ import numpy as np
 
 from mpl_toolkits.mplot3d import Axes3D
 
+import cache
 import constants as C
+import gaps
+import metadata
+import regions
 import util
 
-TARGET = C.cols('target-x', 'target-y', 'target-z')
-N = 2
 X = ((0.4, 0.6), (-0.6, -0.4)) # -0.6 to 0.6
 Y = ((1.7, 1.9), (0.6, 0.8)) # 0.6 to 1.9
 Z = (-0.1, 0.1) # -0.6 to 0.6
+TITLES = 'Top Right', 'Top Left', 'Bottom Right', 'Bottom Left'
 
 
-def within_region(frame, i):
-    b, a = divmod(i, N)
-    x, y, z = frame[TARGET]
-    return (X[a][0] < x < X[a][1] and
-            Y[b][0] < y < Y[b][1] and
-            Z[0] < z < Z[1])
-
-
-def main(dataset='measurements.npy'):
+@climate.annotate(
+    dataset='dataset to plot',
+    n=('split the target area into an n x n grid of regions', 'option', None, int),
+    fill=('fill marker dropouts of up to this many frames', 'option', None, int),
+)
+def main(dataset='measurements.npy', n=0, fill=0):
     data = np.load(dataset, mmap_mode='r')
     print 'loaded', dataset, data.shape
 
-    plots = list(range(N * N))
-    frames = [[] for _ in plots]
-    for subj in data:
-        for block in subj[1:]:
-            for trial in block:
-                if trial[0, C.col('trial-hand')] == C.right:
-                    for frame in trial:
-                        for i in plots:
-                            if within_region(frame, i):
-                                frames[i].append(frame)
-                                break
+    index = metadata.for_dataset(dataset, data)
+    if fill > 0:
+        data = gaps.cached(cache.Cache(dataset), data, max_gap=fill)
+
+    grid = regions.Grid(X, Y, Z)
+    titles = TITLES
+    if n > 0:
+        grid = regions.Grid.uniform(n, (-0.6, 0.6), (0.6, 1.9), Z)
+        titles = ['Region {}'.format(i) for i in range(len(grid))]
+
+    rows = index.rows(block=lambda b: b > 0, trial_hand=C.right)
+    selected = np.zeros(data.shape[:3], bool)
+    selected[rows['subject'], rows['block'], rows['trial']] = True
+    stats = regions.postures(grid, data, selected)
 
     u, v = np.mgrid[0:2 * np.pi:11j, 0:np.pi:7j]
-    sphx = np.cos(u) * np.sin(v)
-    sphy = np.sin(u) * np.sin(v)
-    sphz = np.cos(v)
+    sphere = np.array([np.cos(u) * np.sin(v), np.sin(u) * np.sin(v), np.cos(v)])
 
     fig = plt.figure()
-    for i, postures in enumerate(frames):
-        if not postures:
-            continue
-        if i != 2:
+    for i in range(len(grid)):
+        if not stats.count[i].any():
             continue
 
-        postures = np.array(postures)
-        for m in range(50):
-            marker = postures[:, 17+m*4:17+(m+1)*4]
-            drops = marker[:, 3] < 0
-            marker[drops, :3] = marker[~drops, :3].mean(axis=0)
-        means = postures.mean(axis=0)
-        stds = postures.std(axis=0)
+        means = np.zeros(data.shape[-1])
+        util.markers(means)[:, :3] = np.nan_to_num(stats.mean[i])
+        util.markers(means)[:, 3] = np.where(stats.count[i] > 0, 1, -1)
 
         #ax = util.axes(fig, 111)
         #for frame in postures[::5]:
         #    util.plot_skeleton(ax, frame, alpha=0.1)
-        ax = util.axes(fig, 110 * N + i + 1)
+        ax = util.axes(fig, (len(grid.y), len(grid.x), i + 1))
         util.plot_skeleton(ax, means, alpha=1.0)
-        for m in range(50):
-            mx, my, mz = means[17+m*4:20+m*4]
-            sx, sy, sz = stds[17+m*4:20+m*4] / 2
-            ax.plot_wireframe(sphx * sx + mx, sphz * sz + mz, sphy * sy + my,
-                              color=C.MARKER_COLORS[m], alpha=0.3)
+        # draw an ellipsoid along the principal axes of each marker's
+        # covariance, with radii of half a standard deviation.
+        for m, (center, cov) in enumerate(zip(stats.mean[i], stats.covariance[i])):
+            if stats.count[i, m] < 2:
+                continue
+            lengths, axes = np.linalg.eigh(cov)
+            scale = axes * np.sqrt(np.maximum(lengths, 0)) / 2
+            x, y, z = np.einsum('ij,j...->i...', scale, sphere) + center[:, None, None]
+            ax.plot_wireframe(x, z, y, color=C.MARKER_COLORS[m], alpha=0.3)
 
         #tgtx, tgty, tgtz = postures.mean(axis=0)[
         #    C.cols('target-x', 'target-y', 'target-z')]
@@ -83,7 +82,7 @@ def main(dataset='measurements.npy'):
         ax.w_xaxis.set_pane_color((1, 1, 1, 1))
         ax.w_yaxis.set_pane_color((1, 1, 1, 1))
         ax.w_zaxis.set_pane_color((1, 1, 1, 1))
-        ax.set_title(['Top Right', 'Top Left', 'Bottom Right', 'Bottom Left'][i])
+        ax.set_title(titles[i])
 
     #for m in range(50):
     #    x, z, y = frame[m*4:m*4+3]
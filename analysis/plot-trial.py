@@ -7,7 +7,7 @@ from mpl_toolkits.mplot3d import Axes3D
 import constants as C
 import util
 
-TARGET = C.cols('target-x', 'target-y', 'target-z')
+TARGET = C.COLUMN_GROUPS['target']
 
 
 def main(dataset='measurements.npy'):
@@ -18,8 +18,7 @@ def main(dataset='measurements.npy'):
     ax = util.axes(fig, 111)
 
     trial = data[15, 1, 5]
-    for f in range(0, len(trial), 300):
-        util.plot_skeleton(ax, trial[f], alpha=1)
+    util.plot_skeleton(ax, trial[::300], alpha=1)
     x, y, z = trial[:, TARGET].T
     ax.plot(x, z, y, 'o-', color='#111111', alpha=0.5)
 
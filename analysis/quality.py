@@ -0,0 +1,191 @@
+'''Data-quality metrics for imported trials.
+
+While trials are imported, a few vectorized checks are run over the frames of
+each one, and the results are saved in a compact table beside the dataset
+(``quality.npy`` for directory datasets, ``<name>-quality.npy`` otherwise),
+with one row per trial in the same order as the metadata table. Analyses can
+then exclude bad trials without rescanning any frames:
+
+>>> table = quality.load('measurements.npy')
+>>> index = metadata.for_dataset('measurements.npy')
+>>> rows = index.table[index.mask(trial_hand=C.right) &
+...                    quality.acceptable(table, max_dropout=0.2)]
+'''
+
+import climate
+import numpy as np
+
+import constants as C
+import metadata
+
+logging = climate.get_logger('quality')
+
+MARKERS = C.COLUMN_GROUPS['markers']
+NUM_MARKERS = (MARKERS.stop - MARKERS.start) // 4
+
+DTYPE = np.dtype([
+    ('subject', 'i4'), ('block', 'i4'), ('trial', 'i4'), ('frames', 'i4'),
+    # fraction of frames where each marker was not tracked (c <= 0).
+    ('dropout', 'f4', (NUM_MARKERS, )),
+    # longest run of consecutive untracked frames for each marker.
+    ('longest-gap', 'i4', (NUM_MARKERS, )),
+    # number of frames where a tracked marker did not move at all.
+    ('stuck', 'i4', (NUM_MARKERS, )),
+    # number of skipped and repeated frame numbers.
+    ('frame-gaps', 'i4'),
+    ('duplicates', 'i4'),
+    # number of frames whose elapsed time did not increase.
+    ('backwards', 'i4'),
+    # mean and standard deviation of the time between frames, in seconds.
+    ('interval', 'f4'),
+    ('jitter', 'f4'),
+])
+
+
+def measure(frames):
+    '''Compute quality metrics for the frames of one trial.
+
+    Parameters
+    ----------
+    frames : ndarray
+        A (frame, column) array with the columns of ``constants.COLUMNS``.
+
+    Returns
+    -------
+    metrics : ndarray
+        A structured scalar with dtype ``DTYPE``. The subject, block and trial
+        fields are left as zero.
+    '''
+    metrics = np.zeros((), DTYPE)
+    metrics['frames'] = len(frames)
+    if not len(frames):
+        return metrics
+
+    markers = frames[:, MARKERS].reshape((len(frames), NUM_MARKERS, 4))
+    dropped = ~(markers[:, :, 3] > 0)
+    metrics['dropout'] = dropped.mean(axis=0)
+
+    # length of the run of dropped frames ending at each frame.
+    counts = np.cumsum(dropped, axis=0)
+    resets = np.maximum.accumulate(np.where(dropped, 0, counts), axis=0)
+    metrics['longest-gap'] = (counts - resets).max(axis=0)
+
+    tracked = ~dropped[1:] & ~dropped[:-1]
+    still = (np.diff(markers[:, :, :3], axis=0) == 0).all(axis=2)
+    metrics['stuck'] = (still & tracked).sum(axis=0)
+
+    steps = np.diff(frames[:, C.col('frame')])
+    metrics['frame-gaps'] = (steps > 1).sum()
+    metrics['duplicates'] = (steps == 0).sum()
+
+    intervals = np.diff(frames[:, C.col('elapsed')])
+    metrics['backwards'] = (intervals <= 0).sum()
+    if len(intervals):
+        metrics['interval'] = intervals.mean()
+        metrics['jitter'] = intervals.std()
+    return metrics
+
+
+def path_for(dataset):
+    '''Get the name of the quality table for a dataset.'''
+    return metadata.path_for(dataset, 'quality')
+
+
+def load(dataset):
+    '''Load the quality table for a dataset.'''
+    return np.load(path_for(dataset))
+
+
+def acceptable(table, max_dropout=1, max_gap=None, markers=None):
+    '''Get a boolean mask of the trials that pass some quality thresholds.
+
+    Trials with frame-number gaps, repeated frames or elapsed times that do
+    not increase are always rejected.
+
+    Parameters
+    ----------
+    table : ndarray
+        A quality table.
+    max_dropout : float, optional
+        Reject trials where any of the markers was untracked for more than
+        this fraction of frames. Defaults to 1, which never rejects.
+    max_gap : int, optional
+        Reject trials where any of the markers was untracked for more than this
+        many consecutive frames. By default gap lengths are not checked.
+    markers : sequence of int, optional
+        Only check dropouts and gaps for these markers. Defaults to all.
+
+    Returns
+    -------
+    mask : ndarray of bool
+        True for each trial that passes.
+    '''
+    if markers is None:
+        markers = slice(None)
+    mask = ((table['frame-gaps'] == 0) &
+            (table['duplicates'] == 0) &
+            (table['backwards'] == 0))
+    mask &= (table['dropout'][:, markers] <= max_dropout).all(axis=1)
+    if max_gap is not None:
+        mask &= (table['longest-gap'][:, markers] <= max_gap).all(axis=1)
+    return mask
+
+
+class Report(object):
+    '''Collect quality metrics for a list of trials as they are imported.
+
+    Pass a report to ``ingest.load_trials`` (or to any of the dataset writers)
+    to have the metrics of each trial computed by the worker that parses it.
+
+    Parameters
+    ----------
+    jobs : list of ingest.Job
+        The trials being imported.
+    '''
+
+    measure = staticmethod(measure)
+
+    def __init__(self, jobs):
+        self.table = np.zeros(len(jobs), DTYPE)
+        self.table['subject'] = [job.subject for job in jobs]
+        self.table['block'] = [job.block for job in jobs]
+        self.table['trial'] = [job.trial for job in jobs]
+        self._rows = dict(((job.subject, job.block, job.trial), i)
+                          for i, job in enumerate(jobs))
+
+    def add(self, job, metrics):
+        '''Record the metrics computed for one trial.'''
+        row = self._rows[job.subject, job.block, job.trial]
+        for name in DTYPE.names[3:]:
+            self.table[name][row] = metrics[name]
+
+    def save(self, dataset):
+        '''Write the quality table beside a dataset and log a summary.'''
+        np.save(path_for(dataset), self.table)
+        logging.info('wrote quality metrics for %d trials to %s',
+                     len(self.table), path_for(dataset))
+        self.summarize()
+
+    def summarize(self):
+        '''Log a summary of the quality problems found.'''
+        table = self.table
+        if not len(table):
+            return
+        for name in ('frame-gaps', 'duplicates', 'backwards'):
+            bad = table[name] > 0
+            if bad.any():
+                first = table[bad][0]
+                logging.warning('%d trials with %s, first in subject %d, '
+                                'block %d, trial %d', bad.sum(), name,
+                                first['subject'], first['block'], first['trial'])
+        dropout = table['dropout'].mean(axis=0)
+        worst = np.argsort(dropout)[::-1][:5]
+        logging.info('mean marker dropout %.1f%%; worst markers %s',
+                     100 * dropout.mean(),
+                     ', '.join('{} ({:.1f}%)'.format(m, 100 * dropout[m])
+                               for m in worst))
+        logging.info('longest marker gap %d frames; median frame interval '
+                     '%.1f ms, median jitter %.1f ms',
+                     table['longest-gap'].max(),
+                     1000 * np.median(table['interval']),
+                     1000 * np.median(table['jitter']))
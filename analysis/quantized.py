@@ -0,0 +1,157 @@
+'''Quantized dataset storage, with fixed-point marker positions.
+
+A quantized dataset is a ragged dataset (see the ragged module) whose frame
+table is split into three arrays:
+
+- ``columns.npy`` -- the first 17 columns (config, timing, target, finger and
+  head) as float32.
+- ``positions.npy`` -- marker positions, with shape (frames, 50, 3), stored
+  as int16 (the default) or int32 multiples of ``RESOLUTION`` meters.
+- ``conditions.npy`` -- marker conditions, with shape (frames, 50), as int8.
+  Conditions are clipped to [-127, 127] and rounded away from zero when
+  positive, so a tracked marker (condition > 0) stays tracked.
+
+The smallest value of each integer type marks a missing (NaN) value. Phasespace
+reports positions to about 0.1 mm, so at the default resolution nothing of
+value is lost, while each marker takes 7 bytes per frame instead of 16.
+With int16, positions more than 3.2767 m from the origin are stored as missing,
+with a warning; use 32 bits for larger capture volumes.
+'''
+
+import climate
+import numpy as np
+import os
+
+import constants as C
+import ingest
+import ragged
+
+logging = climate.get_logger('quantized')
+
+# size in meters of one unit of the stored marker positions.
+RESOLUTION = 1e-4
+
+MARKERS = C.COLUMN_GROUPS['markers']
+
+
+def quantize(values, dtype):
+    '''Round values to integers, marking NaNs with the smallest integer.
+
+    Values that do not fit in the integer type are also marked missing, and
+    logged.
+    '''
+    info = np.iinfo(dtype)
+    missing = np.isnan(values)
+    rounded = np.round(np.where(missing, 0, values))
+    outside = (rounded <= info.min) | (rounded > info.max)
+    if outside.any():
+        logging.warning('storing %d values outside [%d, %d] as missing',
+                        outside.sum(), info.min + 1, info.max)
+    rounded[missing | outside] = info.min
+    return rounded.astype(dtype)
+
+
+def quantize_conditions(values):
+    '''Store marker conditions as int8, keeping tracked markers tracked.
+
+    Positive conditions round up to at least 1 and others round to at most
+    0, so the sign (and with it ``util.valid``) is kept; all are clipped to
+    [-127, 127]. NaNs are marked with the smallest integer.
+    '''
+    with np.errstate(invalid='ignore'):
+        rounded = np.where(values > 0, np.clip(np.ceil(values), 1, 127),
+                           np.clip(np.round(values), -127, 0))
+    return quantize(rounded, 'i1')
+
+
+def dequantize(values, scale=1):
+    '''Convert quantized integers back to float32 values.'''
+    result = values.astype('f') * np.float32(scale)
+    result[values == np.iinfo(values.dtype).min] = np.nan
+    return result
+
+
+def save(jobs, output, workers=1, bits=16, report=None):
+    '''Import trials into a quantized dataset directory.
+
+    Parameters
+    ----------
+    jobs : list of ingest.Job
+        Trials to import, in subject/block/trial order.
+    output : str
+        Directory to write. It is created if needed.
+    workers : int, optional
+        Number of worker processes used to parse trial files.
+    bits : int, optional
+        Store marker positions as 16-bit (the default) or 32-bit integers.
+    report : quality.Report, optional
+        Add the quality metrics of each trial to this report.
+
+    Returns
+    -------
+    dataset : Dataset
+        The saved dataset, opened read-only.
+    '''
+    if not os.path.isdir(output):
+        os.makedirs(output)
+    dtype = {16: 'i2', 32: 'i4'}[bits]
+    markers = (MARKERS.stop - MARKERS.start) // 4
+    counts = [ingest.count_frames(job.path) for job in jobs]
+    total = int(sum(counts))
+    logging.info('writing %d quantized frames to %s', total, output)
+
+    def open_memmap(name, dtype, shape):
+        return np.lib.format.open_memmap(
+            os.path.join(output, name + '.npy'),
+            mode='w+', dtype=dtype, shape=(total, ) + shape)
+
+    columns = open_memmap('columns', 'f', (MARKERS.start, ))
+    positions = open_memmap('positions', dtype, (markers, 3))
+    conditions = open_memmap('conditions', 'i1', (markers, ))
+    offset = 0
+    for i, (job, frames) in enumerate(ingest.load_trials(jobs, workers, report)):
+        ragged._check(job, counts[i], frames)
+        rows = slice(offset, offset + len(frames))
+        values = frames[:, MARKERS].reshape((len(frames), markers, 4))
+        columns[rows] = frames[:, :MARKERS.start]
+        positions[rows] = quantize(values[:, :, :3] / RESOLUTION, dtype)
+        conditions[rows] = quantize_conditions(values[:, :, 3])
+        offset += len(frames)
+    for array in (columns, positions, conditions):
+        array.flush()
+    del columns, positions, conditions
+
+    ragged.write_offsets(output, jobs, counts)
+    return Dataset(output)
+
+
+class Dataset(ragged.Dataset):
+    '''A quantized dataset, dequantizing each trial when it is accessed.
+
+    Trials are returned as float32 arrays with the columns of
+    ``constants.COLUMNS``, like the trials of a ragged dataset, but they are
+    new arrays rather than views of the stored data.
+
+    Parameters
+    ----------
+    root : str
+        Directory holding the dataset arrays.
+    mmap_mode : str, optional
+        Memory-map mode for the stored arrays. Defaults to 'r'.
+    '''
+
+    def _open(self, mmap_mode):
+        self.columns = self._load('columns', mmap_mode)
+        self.positions = self._load('positions', mmap_mode)
+        self.conditions = self._load('conditions', mmap_mode)
+
+    def _frames(self, i):
+        rows = slice(self.trials[i], self.trials[i + 1])
+        positions = self.positions[rows]
+        markers = np.empty(positions.shape[:2] + (4, ), 'f')
+        markers[:, :, :3] = dequantize(positions, RESOLUTION)
+        markers[:, :, 3] = dequantize(self.conditions[rows])
+        frames = np.empty((len(markers), len(C.COLUMNS)), 'f')
+        frames[:, :MARKERS.start] = self.columns[rows]
+        frames[:, MARKERS] = markers.reshape((len(markers), -1))
+        return frames
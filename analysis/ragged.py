@@ -0,0 +1,374 @@
+'''Ragged dataset storage: one frame table plus CSR-style offsets.
+
+A ragged dataset is a directory holding four arrays:
+
+- ``frames.npy`` -- all frames of all trials, concatenated along axis 0,
+  with the same columns as the dense dataset (see ``constants.COLUMNS``).
+- ``trials.npy`` -- frame offsets; trial i occupies rows
+  ``trials[i]:trials[i+1]`` of the frame table.
+- ``blocks.npy`` -- trial offsets; block k holds trials
+  ``blocks[k]:blocks[k+1]``.
+- ``subjects.npy`` -- block offsets; subject s holds blocks
+  ``subjects[s]:subjects[s+1]``.
+
+Trials can have any number of frames, and no space is spent on padding.
+
+Datasets written by ``update`` also hold a ``manifest.json`` listing the path
+(relative to the measurement root), size and modification time of each trial
+file, in trial order. Later updates only parse files that are new or changed.
+The per-trial metadata and quality tables (see the metadata and quality
+modules) are kept up to date along with the frames.
+'''
+
+import climate
+import io
+import json
+import numpy as np
+import os
+import time
+
+import constants as C
+import ingest
+import metadata
+import quality
+
+logging = climate.get_logger('ragged')
+
+
+def _starts(keys):
+    '''Return the indices where a sorted sequence of keys changes value.'''
+    starts = [i for i, k in enumerate(keys) if i == 0 or k != keys[i - 1]]
+    return starts + [len(keys)]
+
+
+MANIFEST = 'manifest.json'
+
+
+def save(jobs, output, workers=1, dtype='f', report=None):
+    '''Import trials into a ragged dataset directory.
+
+    The frame table is sized from the line counts of the trial files and
+    filled through a memory map, one trial at a time.
+
+    Parameters
+    ----------
+    jobs : list of ingest.Job
+        Trials to import, in subject/block/trial order.
+    output : str
+        Directory to write. It is created if needed.
+    workers : int, optional
+        Number of worker processes used to parse trial files.
+    dtype : str, optional
+        Data type of the frame table. Defaults to float32.
+    report : quality.Report, optional
+        Add the quality metrics of each trial to this report.
+
+    Returns
+    -------
+    dataset : Dataset
+        The saved dataset, opened read-only.
+    '''
+    if not os.path.isdir(output):
+        os.makedirs(output)
+    counts = [ingest.count_frames(job.path) for job in jobs]
+    _write_frames(os.path.join(output, 'frames.npy'), jobs, counts,
+                  ingest.load_trials(jobs, workers, report), dtype)
+    write_offsets(output, jobs, counts)
+    return Dataset(output)
+
+
+def _check(job, count, values):
+    if len(values) != count:
+        raise ValueError('{}: expected {} frames, read {}'.format(
+            job.path, count, len(values)))
+
+
+def _write_frames(path, jobs, counts, trials, dtype):
+    '''Write a frame table from an iterable of (job, values) pairs.'''
+    shape = (int(sum(counts)), len(C.COLUMNS))
+    logging.info('writing %s frames to %s', shape, path)
+    frames = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+    offset = 0
+    for i, (job, values) in enumerate(trials):
+        _check(job, counts[i], values)
+        frames[offset:offset + counts[i]] = values
+        offset += counts[i]
+    frames.flush()
+
+
+def write_offsets(output, jobs, counts):
+    '''Write the trial, block and subject offset arrays for a dataset.'''
+    trials = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    blocks = _starts([(job.subject, job.block) for job in jobs])
+    subjects = _starts([jobs[i].subject for i in blocks[:-1]])
+    np.save(os.path.join(output, 'trials.npy'), trials)
+    np.save(os.path.join(output, 'blocks.npy'), np.array(blocks, np.int64))
+    np.save(os.path.join(output, 'subjects.npy'), np.array(subjects, np.int64))
+
+
+def _stat(root, job):
+    stat = os.stat(job.path)
+    return [os.path.relpath(job.path, root), stat.st_size, stat.st_mtime]
+
+
+def _npy_header(dtype, shape):
+    handle = io.BytesIO()
+    np.lib.format.write_array_header_1_0(handle, {
+        'descr': np.lib.format.dtype_to_descr(dtype),
+        'fortran_order': False,
+        'shape': shape,
+    })
+    return handle.getvalue()
+
+
+def _append_frames(path, jobs, counts, trials):
+    '''Append trials to a frame table in place, if its header allows it.
+
+    The .npy header is rewritten with the new row count once all rows are
+    written. This only works if the new header has the same length as the old
+    one; if not, nothing is written and False is returned.
+    '''
+    with open(path, 'r+b') as handle:
+        if np.lib.format.read_magic(handle) != (1, 0):
+            return False
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(handle)
+        header = _npy_header(dtype, (shape[0] + sum(counts),) + shape[1:])
+        if fortran_order or len(header) != handle.tell():
+            return False
+        logging.info('appending %d frames to %s', sum(counts), path)
+        handle.seek(0, os.SEEK_END)
+        for i, (job, values) in enumerate(trials):
+            _check(job, counts[i], values)
+            handle.write(np.ascontiguousarray(values, dtype).tobytes())
+        handle.seek(0)
+        handle.write(header)
+    return True
+
+
+def update(root, output, workers=1, dtype='f'):
+    '''Bring a ragged dataset up to date with a measurement tree.
+
+    Trial files are compared with the manifest of the existing dataset by
+    path, size and modification time, and only new or changed files are
+    parsed. When the new files all sort after the ones already imported (the
+    usual case when a session has been added), their frames are appended to
+    the existing frame table. Otherwise a new table is written, copying the
+    frames of unchanged trials from the old one. The metadata and quality
+    tables are rewritten to match.
+
+    Parameters
+    ----------
+    root : str
+        Directory containing one subdirectory per subject.
+    output : str
+        Dataset directory. A new dataset is written if it has no manifest.
+    workers : int, optional
+        Number of worker processes used to parse trial files.
+    dtype : str, optional
+        Data type of the frame table. Defaults to float32.
+
+    Returns
+    -------
+    dataset : Dataset
+        The updated dataset, opened read-only.
+    '''
+    jobs = ingest.find_trials(root)
+    entries = [_stat(root, job) for job in jobs]
+    manifest = os.path.join(output, MANIFEST)
+
+    report = quality.Report(jobs)
+
+    if not os.path.exists(manifest):
+        save(jobs, output, workers, dtype, report)
+    else:
+        with open(manifest) as handle:
+            previous = json.load(handle)
+        if (previous == entries and
+                os.path.exists(metadata.path_for(output)) and
+                os.path.exists(quality.path_for(output))):
+            logging.info('%s is up to date', output)
+            return Dataset(output)
+
+        offsets = np.load(os.path.join(output, 'trials.npy'))
+        index = dict((tuple(e), i) for i, e in enumerate(previous))
+        reuse = [index.get(tuple(e)) for e in entries]
+        fresh = [job for job, i in zip(jobs, reuse) if i is None]
+        counts = [ingest.count_frames(job.path) if i is None
+                  else int(offsets[i + 1] - offsets[i])
+                  for job, i in zip(jobs, reuse)]
+        logging.info('%d of %d trials are new or changed',
+                     len(fresh), len(jobs))
+
+        path = os.path.join(output, 'frames.npy')
+        n = len(previous)
+        appended = False
+        if reuse[:n] == list(range(n)):
+            appended = _append_frames(
+                path, fresh, counts[n:],
+                ingest.load_trials(fresh, workers, report))
+        if not appended:
+            def merged(old, parsed):
+                for job, i in zip(jobs, reuse):
+                    if i is None:
+                        yield next(parsed)
+                    else:
+                        yield job, old._frames(i)
+            trials = merged(Dataset(output),
+                            ingest.load_trials(fresh, workers, report))
+            _write_frames(path + '.tmp', jobs, counts, trials, dtype)
+            del trials
+            os.remove(path)
+            os.rename(path + '.tmp', path)
+        write_offsets(output, jobs, counts)
+
+        # reuse the quality metrics of unchanged trials if we have them.
+        dataset = Dataset(output)
+        metrics = None
+        if os.path.exists(quality.path_for(output)):
+            metrics = quality.load(output)
+            if len(metrics) != len(previous):
+                metrics = None
+        for j, (job, i) in enumerate(zip(jobs, reuse)):
+            if i is not None:
+                report.add(job, metrics[i] if metrics is not None
+                           else quality.measure(dataset._frames(j)))
+        del dataset
+
+    with open(manifest, 'w') as handle:
+        json.dump(entries, handle)
+    metadata.save(jobs, output, report.table['frames'])
+    report.save(output)
+    return Dataset(output)
+
+
+def _snapshot(root):
+    '''List the path, size and modification time of every file under root.'''
+    files = []
+    for path, _, names in os.walk(root):
+        for name in names:
+            stat = os.stat(os.path.join(path, name))
+            files.append((os.path.join(path, name), stat.st_size, stat.st_mtime))
+    return sorted(files)
+
+
+def watch(root, output, interval=60, workers=1, dtype='f'):
+    '''Poll a measurement tree and import sessions as they land.
+
+    This is meant to watch the measurements directory that sessions are
+    copied into at the end of each experiment (see ``Experiment.teardown`` in
+    vizard/main.py). The dataset is only updated once the files under root
+    have stayed the same for one polling interval, so sessions that are still
+    being copied are not imported half-way. Runs until interrupted.
+
+    Parameters
+    ----------
+    root : str
+        Directory containing one subdirectory per subject.
+    output : str
+        Dataset directory to keep up to date.
+    interval : float, optional
+        Seconds to wait between polls. Defaults to 60.
+    workers : int, optional
+        Number of worker processes used to parse trial files.
+    dtype : str, optional
+        Data type of the frame table. Defaults to float32.
+    '''
+    imported = seen = None
+    while True:
+        snapshot = _snapshot(root)
+        if snapshot == seen and snapshot != imported:
+            update(root, output, workers, dtype)
+            imported = snapshot
+        seen = snapshot
+        time.sleep(interval)
+
+
+class Dataset(object):
+    '''A ragged dataset, giving zero-copy views of individual trials.
+
+    Iterating over a dataset yields one list of blocks per subject, where each
+    block is a sequence of per-trial frame arrays. This mirrors iteration over the
+    dense (subject, block, trial, frame, column) array, so loops like
+
+    >>> for subject in dataset:
+    ...     for block in subject:
+    ...         for trial in block:
+    ...             pass
+
+    work unchanged, except that trials can have different lengths.
+
+    Parameters
+    ----------
+    root : str
+        Directory holding the dataset arrays.
+    mmap_mode : str, optional
+        Memory-map mode for the frame table. Defaults to 'r'.
+    '''
+
+    def __init__(self, root, mmap_mode='r'):
+        self.root = root
+        self.trials = self._load('trials')
+        self.blocks = self._load('blocks')
+        self.subjects = self._load('subjects')
+        self._open(mmap_mode)
+
+    def _load(self, name, mmap_mode=None):
+        return np.load(os.path.join(self.root, name + '.npy'), mmap_mode=mmap_mode)
+
+    def _open(self, mmap_mode):
+        self.frames = self._load('frames', mmap_mode)
+
+    def __len__(self):
+        return len(self.subjects) - 1
+
+    def __getitem__(self, key):
+        return self.trial(*key)
+
+    def __iter__(self):
+        for s in range(len(self)):
+            yield [_Block(self, self.blocks[k], self.blocks[k + 1])
+                   for k in range(self.subjects[s], self.subjects[s + 1])]
+
+    @property
+    def frame_counts(self):
+        '''Number of frames in each trial, in subject/block/trial order.'''
+        return np.diff(self.trials)
+
+    def _frames(self, i):
+        return self.frames[self.trials[i]:self.trials[i + 1]]
+
+    def trial_index(self, subject, block, trial):
+        '''Get the flat index of a trial from its dataset coordinates.'''
+        if not 0 <= subject < len(self):
+            raise IndexError('no subject {}'.format(subject))
+        first, last = self.subjects[subject:subject + 2]
+        if not 0 <= block < last - first:
+            raise IndexError('no block {} for subject {}'.format(block, subject))
+        first, last = self.blocks[first + block:first + block + 2]
+        if not 0 <= trial < last - first:
+            raise IndexError('no trial {} in block {} for subject {}'.format(
+                trial, block, subject))
+        return first + trial
+
+    def trial(self, subject, block, trial):
+        '''Get a view of the frames for one trial.'''
+        return self._frames(self.trial_index(subject, block, trial))
+
+
+class _Block(object):
+    '''A lazy sequence of the trials in one block of a ragged dataset.'''
+
+    def __init__(self, dataset, first, last):
+        self.dataset = dataset
+        self.first = first
+        self.last = last
+
+    def __len__(self):
+        return self.last - self.first
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if not -len(self) <= i < len(self):
+            raise IndexError('no trial {} in block'.format(i))
+        return self.dataset._frames(self.first + i % len(self))
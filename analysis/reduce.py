@@ -0,0 +1,302 @@
+'''Chunked reductions over datasets that do not fit in memory.
+
+Even with ``mmap_mode='r'``, computing over the whole dense dataset at once
+builds intermediate arrays as large as the dataset. The functions here walk a
+memory-mapped dataset a few trials at a time instead, reading at most a fixed
+number of bytes per chunk, and combine the results of a kernel applied to
+each chunk:
+
+>>> mean, std = reduce.map_trials(data, errors.trial_stats)
+>>> moments = reduce.fold(data, lambda chunk: reduce.Moments.of(
+...     errors.pairwise(chunk).reshape((-1, 3))))
+
+Partial statistics are combined with ``Moments``, which merges counts, means
+and variances exactly, so the result does not depend on the chunk size.
+'''
+
+import climate
+import numpy as np
+
+logging = climate.get_logger('reduce')
+
+# default number of bytes of frame data to read per chunk.
+BUDGET = 256 * 2 ** 20
+
+
+def chunks(data, budget=BUDGET):
+    '''Iterate over the trials of a dense dataset in bounded chunks.
+
+    Parameters
+    ----------
+    data : ndarray
+        A dense (subject, block, trial, frame, column) dataset, usually
+        memory-mapped. Other datasets with a ``shape``, a ``dtype`` and a
+        ``read_trials(start, stop)`` method, like ``columnar.Dataset``, can be
+        used instead.
+    budget : int, optional
+        Read at most this many bytes of frame data per chunk, but always at
+        least one trial. Defaults to ``BUDGET``.
+
+    Yields
+    ------
+    start, stop : int
+        Range of the chunk in the trials of the dataset, flattened in
+        (subject, block, trial) order.
+    frames : ndarray
+        The frames of those trials, with shape (stop - start, frame, column),
+        loaded into memory.
+    '''
+    count = int(np.prod(data.shape[:3]))
+    read = getattr(data, 'read_trials', None)
+    if read is None:
+        trials = data.reshape((count, ) + data.shape[3:])
+        read = lambda start, stop: np.asarray(trials[start:stop])
+    trial = int(np.prod(data.shape[3:])) * np.dtype(data.dtype).itemsize
+    size = max(1, int(budget // max(1, trial)))
+    logging.info('reducing %d trials in chunks of %d', count, size)
+    for start in range(0, count, size):
+        stop = min(start + size, count)
+        yield start, stop, read(start, stop)
+
+
+def map_trials(data, kernel, budget=BUDGET):
+    '''Apply a per-trial kernel to every trial of a dense dataset.
+
+    Parameters
+    ----------
+    data : ndarray
+        A dense (subject, block, trial, frame, column) dataset.
+    kernel : callable
+        Called with an array of frames with shape (trial, frame, column) for
+        each chunk. It must return an array, or a tuple of arrays, with one
+        leading entry per trial.
+    budget : int, optional
+        Read at most this many bytes of frame data per chunk.
+
+    Returns
+    -------
+    result : ndarray or tuple of ndarray
+        The kernel results for every trial, with shape (subject, block,
+        trial, ...).
+    '''
+    results = None
+    for start, stop, frames in chunks(data, budget):
+        values = kernel(frames)
+        single = not isinstance(values, tuple)
+        if single:
+            values = (values, )
+        if results is None:
+            results = tuple(
+                np.empty((int(np.prod(data.shape[:3])), ) + v.shape[1:], v.dtype)
+                for v in values)
+        for result, value in zip(results, values):
+            result[start:stop] = value
+    results = tuple(r.reshape(data.shape[:3] + r.shape[1:]) for r in results)
+    return results[0] if single else results
+
+
+def fold(data, kernel, budget=BUDGET):
+    '''Combine partial results of a kernel over the chunks of a dataset.
+
+    Parameters
+    ----------
+    data : ndarray
+        A dense (subject, block, trial, frame, column) dataset.
+    kernel : callable
+        Called with an array of frames with shape (trial, frame, column) for
+        each chunk. Its results are combined with their ``merge`` method if
+        they have one (like ``Moments``), or by adding them otherwise.
+    budget : int, optional
+        Read at most this many bytes of frame data per chunk.
+
+    Returns
+    -------
+    result :
+        The combined result for the whole dataset.
+    '''
+    total = None
+    for _, _, frames in chunks(data, budget):
+        partial = kernel(frames)
+        if total is None:
+            total = partial
+        elif hasattr(total, 'merge'):
+            total = total.merge(partial)
+        else:
+            total = total + partial
+    return total
+
+
+class Moments(object):
+    '''Count, mean and variance of some values, mergeable across chunks.
+
+    Parameters
+    ----------
+    count : ndarray
+        Number of values summarized.
+    mean : ndarray
+        Mean of the values.
+    m2 : ndarray
+        Sum of squared deviations of the values from their mean.
+    '''
+
+    def __init__(self, count, mean, m2):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    @classmethod
+    def of(cls, values, axis=0):
+        '''Summarize the finite values along one axis of an array.'''
+        values = np.asarray(values, float)
+        valid = np.isfinite(values)
+        count = valid.sum(axis=axis)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(valid, values, 0).sum(axis=axis) / count
+            dev = np.where(valid, values - np.expand_dims(mean, axis), 0)
+        return cls(count, mean, (dev ** 2).sum(axis=axis))
+
+    def merge(self, other):
+        '''Combine these moments with those of another set of values.
+
+        The result is exact: it equals the moments of all the values taken
+        together (up to rounding), in any merge order.
+        '''
+        count = self.count + other.count
+        # empty summaries have NaN means, which must not leak into the result.
+        a = np.where(self.count > 0, self.mean, 0)
+        b = np.where(other.count > 0, other.mean, 0)
+        weight = other.count / np.maximum(count, 1.)
+        delta = b - a
+        mean = np.where(count > 0, a + delta * weight, np.nan)
+        m2 = self.m2 + other.m2 + delta ** 2 * self.count * weight
+        return Moments(count, mean, m2)
+
+    @property
+    def var(self):
+        '''Population variance of the values (NaN if there are none).'''
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.m2 / self.count
+
+    @property
+    def std(self):
+        '''Population standard deviation of the values.'''
+        return np.sqrt(self.var)
+
+
+class Covariance(object):
+    '''Running means and covariances of vectors, split into groups.
+
+    Batches of vectors are summarized and merged into the running totals with
+    the pairwise (Chan et al.) form of Welford's update, so the totals stay
+    exact and accurate however the data are split, and two accumulators
+    filled in different processes can be merged:
+
+    >>> acc = Covariance.empty(len(grid), (50, ), 3)
+    >>> for trial in trials:
+    ...     m = util.markers(trial)
+    ...     acc.update(m[..., :3], grid.classify(trial), util.valid(m))
+    >>> acc.mean, acc.covariance        # (region, 50, 3), (region, 50, 3, 3)
+
+    See ``regions.postures``, which does this over a whole dataset.
+
+    Parameters
+    ----------
+    count : ndarray
+        Number of vectors in each group, with shape (group, ...).
+    mean : ndarray
+        Mean vector of each group, with shape (group, ..., dim).
+    comoment : ndarray
+        Sum of outer products of the deviations from the mean, with shape
+        (group, ..., dim, dim).
+    '''
+
+    def __init__(self, count, mean, comoment):
+        self.count = count
+        self.mean = mean
+        self.comoment = comoment
+
+    @classmethod
+    def empty(cls, groups, shape, dim):
+        '''Create an accumulator holding no vectors.'''
+        shape = (groups, ) + tuple(shape)
+        return cls(np.zeros(shape, int),
+                   np.full(shape + (dim, ), np.nan),
+                   np.zeros(shape + (dim, dim)))
+
+    @classmethod
+    def of(cls, values, groups, size, mask=None):
+        '''Summarize a batch of vectors by group.
+
+        Parameters
+        ----------
+        values : ndarray
+            Vectors with shape (n, ..., dim).
+        groups : ndarray of int
+            Group of each of the n items, with shape (n, ). Items in a
+            negative group are ignored.
+        size : int
+            Number of groups.
+        mask : ndarray of bool, optional
+            Which vectors to include, with shape (n, ...). Vectors with
+            non-finite values are always excluded.
+        '''
+        values = np.asarray(values)
+        groups = np.asarray(groups)
+        rest = values.shape[1:]
+        result = cls.empty(size, rest[:-1], rest[-1])
+        # one group at a time, so only the vectors of one group are copied.
+        for group in np.unique(groups[groups >= 0]):
+            rows = np.flatnonzero(groups == group)
+            x = np.asarray(values[rows], float)
+            valid = np.isfinite(x).all(axis=-1)
+            if mask is not None:
+                valid &= mask[rows]
+            x[~valid] = 0
+            count = valid.sum(axis=0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = x.sum(axis=0) / count[..., None]
+            x -= np.nan_to_num(mean)
+            x[~valid] = 0
+            result.count[group] = count
+            result.mean[group] = mean
+            result.comoment[group] = np.einsum('n...i,n...j->...ij', x, x)
+        return result
+
+    def merge(self, other):
+        '''Combine this accumulator with another, exactly.'''
+        count = self.count + other.count
+        a = np.where(self.count[..., None] > 0, self.mean, 0)
+        b = np.where(other.count[..., None] > 0, other.mean, 0)
+        weight = (other.count / np.maximum(count, 1.))[..., None]
+        delta = b - a
+        mean = np.where(count[..., None] > 0, a + delta * weight, np.nan)
+        scale = (self.count[..., None] * weight)[..., None]
+        comoment = (self.comoment + other.comoment +
+                    delta[..., :, None] * delta[..., None, :] * scale)
+        return Covariance(count, mean, comoment)
+
+    def update(self, values, groups, mask=None):
+        '''Add a batch of vectors to the running totals.
+
+        See ``of`` for the arguments.
+        '''
+        merged = self.merge(Covariance.of(values, groups, len(self.count), mask))
+        self.count, self.mean, self.comoment = (
+            merged.count, merged.mean, merged.comoment)
+        return self
+
+    @property
+    def covariance(self):
+        '''Population covariance matrix of each group.'''
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.comoment / self.count[..., None, None]
+
+    @property
+    def var(self):
+        '''Population variance of each component.'''
+        return np.diagonal(self.covariance, axis1=-2, axis2=-1)
+
+    @property
+    def std(self):
+        '''Population standard deviation of each component.'''
+        return np.sqrt(self.var)
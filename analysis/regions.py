@@ -0,0 +1,170 @@
+'''Classify frames by the region of space holding the target.
+
+A grid is a set of boxes laid out in rows (along y) and columns (along x),
+between two z limits. Every frame of a trial, a batch of trials or the whole
+dense dataset is given the id of the box holding its target in one pass,
+by binning the target columns:
+
+>>> grid = regions.Grid(x=((0.4, 0.6), (-0.6, -0.4)), y=((1.7, 1.9), (0.6, 0.8)))
+>>> ids = grid.classify(data)                 # (subject, block, trial, frame)
+>>> for region, index in enumerate(grid.indices(ids)):
+...     postures = data[index]
+
+The box in row ``b`` and column ``a`` has id ``b * len(x) + a``; frames
+outside every box get -1.
+
+To summarize the postures in each box without gathering their frames, stream
+the dataset through ``postures``, which keeps one running mean and 3 x 3
+covariance per box and marker:
+
+>>> stats = regions.postures(grid, data)
+>>> stats.mean[region], stats.covariance[region]    # (50, 3), (50, 3, 3)
+'''
+
+import numpy as np
+
+import constants as C
+import reduce
+
+
+def _bins(intervals):
+    '''Get sorted bin edges for some intervals, and the interval of each bin.
+
+    Values between the edges of interval ``k`` fall in a bin that maps to
+    ``k``; values outside every interval map to -1.
+    '''
+    intervals = np.asarray(intervals, float)
+    order = np.argsort(intervals[:, 0])
+    edges = intervals[order].ravel()
+    if (np.diff(edges) < 0).any():
+        raise ValueError('intervals must not overlap: {}'.format(intervals))
+    labels = -np.ones(len(edges) + 1, int)
+    labels[1::2] = order
+    return edges, labels
+
+
+class Grid(object):
+    '''A grid of boxes in space, for classifying target positions.
+
+    Parameters
+    ----------
+    x : sequence of (float, float)
+        Intervals of the columns of the grid, along x.
+    y : sequence of (float, float)
+        Intervals of the rows of the grid, along y.
+    z : (float, float), optional
+        Limits of every box along z. Defaults to no limits.
+    '''
+
+    def __init__(self, x, y, z=(-np.inf, np.inf)):
+        self.x = np.asarray(x, float)
+        self.y = np.asarray(y, float)
+        self.z = tuple(z)
+        self._x = _bins(self.x)
+        self._y = _bins(self.y)
+
+    @classmethod
+    def uniform(cls, n, x, y, z=(-np.inf, np.inf)):
+        '''Split a box into an n x n grid of adjacent boxes.
+
+        Parameters
+        ----------
+        n : int
+            Number of rows and of columns.
+        x, y : (float, float)
+            Extent of the whole grid along x and y.
+        z : (float, float), optional
+            Limits along z. Defaults to no limits.
+        '''
+        def split(lo, hi):
+            edges = np.linspace(lo, hi, n + 1)
+            return np.stack([edges[:-1], edges[1:]], axis=1)
+        return cls(split(*x), split(*y), z)
+
+    def __len__(self):
+        return len(self.x) * len(self.y)
+
+    def classify(self, frames):
+        '''Get the id of the box holding the target in each frame.
+
+        Parameters
+        ----------
+        frames : ndarray
+            Frames of data with shape (..., 217).
+
+        Returns
+        -------
+        ids : ndarray of int
+            The box id of each frame, with shape (...). Frames outside every
+            box, or with no target, get -1.
+        '''
+        target = C.view(frames)['target']
+        x, y, z = target[..., 0], target[..., 1], target[..., 2]
+        col = self._x[1][np.digitize(x, self._x[0])]
+        row = self._y[1][np.digitize(y, self._y[0])]
+        inside = (col >= 0) & (row >= 0) & (self.z[0] < z) & (z < self.z[1])
+        return np.where(inside, row * len(self.x) + col, -1)
+
+    def indices(self, ids):
+        '''Get index arrays of the frames in each box.
+
+        Parameters
+        ----------
+        ids : ndarray of int
+            Box ids, as returned by ``classify``.
+
+        Returns
+        -------
+        indices : list of tuple of ndarray
+            For each box, the index of its frames in ``ids``, which can index
+            the frames directly.
+        '''
+        flat = ids.ravel()
+        order = np.argsort(flat, kind='mergesort')
+        bounds = np.searchsorted(flat[order], np.arange(len(self) + 1))
+        return [np.unravel_index(order[lo:hi], ids.shape)
+                for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+
+def postures(grid, data, selected=None, budget=reduce.BUDGET):
+    '''Stream a dense dataset into per-region marker statistics.
+
+    The dataset is read a chunk of trials at a time, so memory use does not
+    depend on its size. Untracked markers are left out of the statistics.
+
+    Parameters
+    ----------
+    grid : Grid
+        Regions to classify frames into.
+    data : ndarray
+        The dense (subject, block, trial, frame, column) dataset.
+    selected : ndarray of bool, optional
+        Which trials to include, with shape (subject, block, trial). Defaults
+        to all trials.
+    budget : int, optional
+        Use at most about this many bytes per chunk, counting the frames read
+        and the working copies made to update the statistics.
+
+    Returns
+    -------
+    stats : reduce.Covariance
+        Count, mean and covariance of the position of each marker in each
+        region, with shapes (region, 50), (region, 50, 3) and
+        (region, 50, 3, 3). Statistics from separate processes can be
+        combined with its ``merge`` method.
+    '''
+    stats = reduce.Covariance.empty(len(grid), (50, ), 3)
+    if selected is not None:
+        selected = np.asarray(selected).ravel()
+    # besides the frames read, a chunk needs a copy of its selected frames
+    # and a float64 copy of the marker positions in each region.
+    row = data.shape[-1] * data.dtype.itemsize
+    budget = budget * row // (2 * row + 50 * 3 * 8)
+    for start, stop, frames in reduce.chunks(data, budget):
+        if selected is not None:
+            frames = frames[selected[start:stop]]
+        frames = frames.reshape((-1, frames.shape[-1]))
+        markers = C.view(frames)['markers']
+        stats.update(markers[..., :3], grid.classify(frames),
+                     markers[..., 3] > 0)
+    return stats
@@ -1,61 +1,253 @@
 import numpy as np
 
+from mpl_toolkits.mplot3d.art3d import Line3DCollection
+
 import constants as C
 
 
-def rx(theta):
+def _rotation(theta, i, j):
+    theta = np.asarray(theta)
     ct = np.cos(theta)
     st = np.sin(theta)
-    return np.array([[1, 0, 0], [0, ct, -st], [0, st, ct]])
+    r = np.zeros(theta.shape + (3, 3))
+    k = 3 - i - j
+    r[..., k, k] = 1
+    r[..., i, i] = ct
+    r[..., i, j] = -st
+    r[..., j, i] = st
+    r[..., j, j] = ct
+    return r
+
+# rotation matrices about each axis. given an array of angles, these return a
+# stack of matrices with shape (..., 3, 3).
+
+def rx(theta):
+    return _rotation(theta, 1, 2)
 
 def ry(theta):
-    ct = np.cos(theta)
-    st = np.sin(theta)
-    return np.array([[ct, 0, st], [0, 1, 0], [-st, 0, ct]])
+    return _rotation(theta, 2, 0)
 
 def rz(theta):
-    ct = np.cos(theta)
-    st = np.sin(theta)
-    return np.array([[ct, -st, 0], [st, ct, 0], [0, 0, 1]])
+    return _rotation(theta, 0, 1)
 
 
 def axes(fig, which=111):
-    ax = fig.add_subplot(which, projection='3d')
+    if not isinstance(which, tuple):
+        which = (which, )
+    ax = fig.add_subplot(*which, projection='3d')
     #ax.axis('off')
     return ax
 
 
-TARGET = C.cols('target-x', 'target-y', 'target-z')
-FINGER = C.cols('finger-x', 'finger-y', 'finger-z')
-HEAD = C.cols('head-x', 'head-y', 'head-z')
-atan = np.arctan2
-
-def canonical(frame, marker):
-    hx, hy, hz = frame[HEAD] - frame[FINGER]
-    ax = 0#atan(hz, hy)
-    ay = -atan(hx, hz)
-    az = 0
-    return np.dot(rx(ax), np.dot(ry(ay), marker - frame[FINGER]))
+TARGET = C.COLUMN_GROUPS['target']
+FINGER = C.COLUMN_GROUPS['finger']
+HEAD = C.COLUMN_GROUPS['head']
 
 
 def identity(frame, marker):
     return marker
 
 
-def plot_skeleton(ax, frame, transform=identity, **kwargs):
-    markers = frame[17:].reshape((-1, 4))
-    for m, color in enumerate(C.MARKER_COLORS):
-        if markers[m, 3] > 0:
-            x, y, z = transform(frame, markers[m, :3])
-        ax.plot([x], [z], [y], 'o', c=color, **kwargs)
-    for ms in C.SKELETON:
-        try:
-            x, y, z = np.array(
-                [transform(frame, markers[m, :3])
-                 for m in ms if markers[m, 3] > 0]).T
-            ax.plot(x, z, y, '-', c='#111111', **kwargs)
-        except ValueError:
-            pass
+def markers(frames):
+    '''Get a view of the markers in an array of frames.
+
+    ``frames`` can be a single frame, a trial, a block or a whole dense
+    dataset; the result has the same leading shape, followed by (50, 4) for
+    the x, y, z and condition values of each marker. No data are copied,
+    unless ``frames`` is not C-contiguous.
+    '''
+    return C.view(frames)['markers']
+
+
+def valid(markers):
+    '''Get a boolean mask of the tracked markers (condition > 0).'''
+    return markers[..., 3] > 0
+
+
+def _masked_sums(values, mask, axis):
+    if mask.ndim < values.ndim:
+        mask = mask[..., None]
+    mask = np.broadcast_to(mask, values.shape)
+    count = mask.sum(axis=axis, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(mask, values, 0).sum(axis=axis, keepdims=True) / count
+    return mask, count, mean
+
+
+def masked_mean(values, mask, axis=0):
+    '''Average values along an axis, skipping those where mask is False.
+
+    ``mask`` has the shape of ``values``, or lacks its last axis, so marker
+    positions can be masked by ``valid(markers)``:
+
+    >>> m = markers(trial)
+    >>> masked_mean(m[..., :3], valid(m))    # (50, 3) mean marker positions
+
+    Means of values that are never unmasked are NaN.
+    '''
+    _, _, mean = _masked_sums(values, mask, axis)
+    return np.squeeze(mean, axis=axis)
+
+
+def masked_std(values, mask, axis=0):
+    '''Get the standard deviation of values where mask is True.
+
+    See ``masked_mean`` for the arguments.
+    '''
+    mask, count, mean = _masked_sums(values, mask, axis)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        var = np.where(mask, values - mean, 0) ** 2
+        return np.squeeze(np.sqrt(var.sum(axis=axis, keepdims=True) / count),
+                          axis=axis)
+
+
+def rotate(frames, positions, origin, rotation):
+    '''Move positions into a coordinate frame given for each frame of data.
+
+    Parameters
+    ----------
+    frames : ndarray
+        Frames of data, with shape (..., 217).
+    positions : ndarray
+        Positions to transform, with shape (..., 3). The leading axes must
+        start with those of ``frames``; any extra axes (like the 50 markers of
+        ``markers(frames)[..., :3]``) share the coordinate frame.
+    origin : ndarray
+        Origin of the coordinate frame, with shape (..., 3) like ``frames``.
+    rotation : ndarray
+        Rotation into the coordinate frame, with shape (..., 3, 3).
+
+    Returns
+    -------
+    positions : ndarray
+        The transformed positions, computed in one batched operation.
+    '''
+    positions = np.asarray(positions)
+    shape = origin.shape[:-1] + (1, ) * (positions.ndim - np.ndim(frames))
+    origin = origin.reshape(shape + (3, ))
+    rotation = rotation.reshape(shape + (3, 3))
+    return np.einsum('...ij,...j->...i', rotation, positions - origin)
+
+
+def _facing(direction):
+    '''Rotations about y that turn the direction onto the +z axis.'''
+    return ry(-np.arctan2(direction[..., 0], direction[..., 2]))
+
+
+def finger_relative(frames, positions):
+    '''Express positions relative to the finger, facing the head.
+
+    Like all the transforms here, this takes a frame and the positions of
+    some of its markers, or whole arrays of frames and positions, so it can be
+    passed as the ``transform`` of ``plot_skeleton``:
+
+    >>> m = markers(trial)
+    >>> finger_relative(trial, m[..., :3])    # (frame, 50, 3)
+    '''
+    view = C.view(frames)
+    return rotate(frames, positions, view['finger'],
+                  _facing(view['head'] - view['finger']))
+
+canonical = finger_relative
+
+
+def head_relative(frames, positions):
+    '''Express positions relative to the head, facing the finger.'''
+    view = C.view(frames)
+    return rotate(frames, positions, view['head'],
+                  _facing(view['finger'] - view['head']))
+
+
+# markers on the right and left hips (the first markers of each leg).
+HIPS = (C.SKELETON[0][0], C.SKELETON[1][0])
+
+def torso_relative(frames, positions):
+    '''Express positions relative to the hips, with the hip line along +x.
+
+    The origin is midway between the hip markers, and the rotation about y
+    turns the line from the left to the right hip onto the x axis. Frames
+    where either hip marker is untracked give NaN.
+    '''
+    hips = markers(frames)[..., list(HIPS), :]
+    hips = np.where(valid(hips)[..., None], hips[..., :3], np.nan)
+    right, left = hips[..., 0, :], hips[..., 1, :]
+    across = right - left
+    return rotate(frames, positions, (right + left) / 2,
+                  ry(np.arctan2(across[..., 2], across[..., 0])))
+
+
+# pairs of markers joined by a bone, from the chains in C.SKELETON.
+BONES = np.array([(a, b) for chain in C.SKELETON
+                  for a, b in zip(chain[:-1], chain[1:])])
+
+
+class Skeleton(object):
+    '''Draw the markers and bones of one or more frames with two artists.
+
+    All markers are drawn by a single scatter and all bones by a single
+    line collection, so drawing many frames stays fast. Call ``update`` with
+    new frames to move the artists in place, for example in an animation:
+
+    >>> skeleton = Skeleton(ax)
+    >>> def draw(f):
+    ...     return skeleton.update(trial[f])
+
+    Parameters
+    ----------
+    ax : Axes3D
+        Axes to draw in.
+    transform : callable, optional
+        Transform applied to the marker positions of the frames, like
+        ``finger_relative``. Defaults to ``identity``.
+    color : color, optional
+        Color of the bones. Markers are colored by ``C.MARKER_COLORS``.
+    kwargs : dict
+        Other keyword arguments (like alpha) are passed to both artists.
+    '''
+
+    def __init__(self, ax, transform=identity, color='#111111', **kwargs):
+        self.ax = ax
+        self.transform = transform
+        self.kwargs = kwargs
+        self.points = None
+        self.bones = Line3DCollection([], colors=color, **kwargs)
+        ax.add_collection(self.bones, autolim=False)
+
+    def update(self, frames):
+        '''Draw the skeleton of one frame, or of an array of frames.
+
+        Returns
+        -------
+        artists : list
+            The marker and bone artists.
+        '''
+        frames = np.asarray(frames)
+        points = markers(frames)
+        positions = self.transform(frames, points[..., :3]).reshape((-1, 50, 3))
+        tracked = valid(points).reshape((-1, 50))
+        # mplot3d axes are (x, z, y), so put the vertical axis last.
+        positions = positions[..., [0, 2, 1]]
+
+        ok = tracked[:, BONES].all(axis=-1)
+        self.bones.set_segments(positions[:, BONES][ok])
+
+        x, y, z = positions[tracked].T
+        colors = C.MARKER_COLORS[np.nonzero(tracked)[1]]
+        if self.points is None:
+            self.points = self.ax.scatter(
+                x, y, z, c=colors, depthshade=False, **self.kwargs)
+        else:
+            self.points._offsets3d = (x, y, z)
+            self.points.set_facecolor(colors)
+            self.points.set_edgecolor(colors)
+        return [self.points, self.bones]
+
+
+def plot_skeleton(ax, frames, transform=identity, **kwargs):
+    '''Draw the skeleton of one frame, or of an array of frames.'''
+    skeleton = Skeleton(ax, transform, **kwargs)
+    skeleton.update(frames)
+    return skeleton
 
 
 def set_limits(ax, center=(0, 0, 1.5), span=1.5):